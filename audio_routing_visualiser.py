@@ -1,76 +1,396 @@
 import argparse
-import json
+import logging
 import os
 from datetime import datetime
-import matplotlib.pyplot as plt
-import pulsectl
-from routing import get_audio_routing, generate_audio_state_json
-from graph import create_audio_routing_graph, update_graph, save_graph_figure
 import time
 import sys
 import signal
+from filters import filter_term
+
+# pulsectl, networkx, matplotlib and the modules using them are imported by the code
+# paths that need them, so --help and one-shot exports don't pay for the plotting stack.
 
 def signal_handler(sig, frame):
     print('You pressed Ctrl-C! Exiting gracefully...')
     sys.exit(0)
 
-signal.signal(signal.SIGINT, signal_handler)
+logger = logging.getLogger('audio_routing_visualiser')
 
 
-def save_audio_state_to_file(state, directory):
-    if not os.path.exists(directory):
-        os.makedirs(directory)
-    timestamp = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
-    file_path = os.path.join(directory, f'state_{timestamp}.json')
-    with open(file_path, 'w') as f:
-        json.dump(state, f, indent=4)
-    return file_path
+def main():
+    # Set here rather than on import, so processes importing watch() from this module keep their own handling
+    signal.signal(signal.SIGINT, signal_handler)
 
+    # "query" answers questions about the routing instead of drawing it, see query.py
+    if sys.argv[1:2] == ['query']:
+        from query import main as query_main
+        query_main(sys.argv[2:])
+        return
 
-def main():
-    parser = argparse.ArgumentParser( description="Visualize PulseAudio routing.")
+    # Long term lists can be kept in a file and passed as @file, one argument per line
+    parser = argparse.ArgumentParser( description="Visualize PulseAudio routing.", fromfile_prefix_chars='@')
     parser.add_argument('--text_wrap', type=int, default=30,
                         help='Number of characters after which to wrap text labels.')
-    parser.add_argument('--hide', nargs='+', default=[],
-                        help='List of strings to hide from graph labels.')
-    parser.add_argument('--ignore', nargs='+', default=[],
-                        help='List of strings to ignore from audio sources and sinks.')
+    parser.add_argument('--hide', nargs='+', default=[], type=filter_term,
+                        help='List of strings to hide from graph labels; re:PATTERN for a regular expression.')
+    parser.add_argument('--ignore', nargs='+', default=[], type=filter_term,
+                        help='List of strings to ignore from audio sources and sinks; re:PATTERN for a regular expression.')
     parser.add_argument('--active', action='store_true',
                         help='Only show active elements in the graph.')
     parser.add_argument('--alpha', action='store_true',
                         help='Sort nodes alphabetically, rather than with minimised edge crossings.', default=False)
+    parser.add_argument('--cluster', choices=['application', 'process'], default=None,
+                        help='Draw the streams of each application (or process) as one node; click it to expand.')
+    parser.add_argument('--cluster_min', type=int, default=2,
+                        help='Smallest number of streams drawn as a cluster.')
+    parser.add_argument('--write_queue', type=int, default=4,
+                        help='Snapshots waiting to be written before older ones are dropped.')
+    parser.add_argument('--keyframe_interval', type=int, default=100,
+                        help='Write a full state to the history every this many changes, deltas in between.')
+    parser.add_argument('--compress_history', action='store_true',
+                        help='Compress the records in the state history.')
+    parser.add_argument('--events', action='store_true',
+                        help='Update from PulseAudio change events instead of polling every second.')
+    parser.add_argument('--export', nargs='+', choices=['svg', 'dot', 'json'], default=[],
+                        help='Run without a window and write the graph in these formats on every change.')
+    parser.add_argument('--once', action='store_true',
+                        help='With --export, write the current graph once and exit.')
+    parser.add_argument('--output_dir', default='./graphs',
+                        help='Directory for the state history, figures and exports.')
+    parser.add_argument('--serve', type=int, default=None, metavar='PORT',
+                        help='Run without a window and stream graph changes to browsers and other clients on this port.')
+    parser.add_argument('--serve_host', default='127.0.0.1',
+                        help='Address to listen on with --serve.')
+    parser.add_argument('--servers', nargs='+', default=[],
+                        help='Watch these PulseAudio servers at once, without a window. Each gets its own history under --output_dir.')
+    parser.add_argument('--min_interval', type=float, default=0.25,
+                        help='Seconds between polls while things are changing.')
+    parser.add_argument('--max_interval', type=float, default=5,
+                        help='Seconds between polls after a long time without changes.')
+    parser.add_argument('--debounce', type=float, default=0.3,
+                        help='Wait this many quiet seconds before redrawing, so a burst of changes is drawn once.')
+    parser.add_argument('--pipeline', action='store_true',
+                        help='Collect, build the graph and draw in three processes, so a slow frame never holds up polling.')
+    parser.add_argument('--fetch_timeout', type=float, default=2.0,
+                        help='Seconds to wait for PulseAudio to list devices and streams on each poll.')
+    parser.add_argument('--stale_policy', choices=['keep', 'fail'], default='keep',
+                        help='On a fetch timeout, keep showing the last state or exit with an error.')
+    parser.add_argument('--log_level', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], default='INFO',
+                        help='DEBUG shows every edge and frame; INFO one summary line per graph update.')
+    parser.add_argument('--metrics_port', type=int, default=None,
+                        help='Serve per-stage timings and counters in Prometheus format on this local port.')
+    parser.add_argument('--stats_interval', type=float, default=None,
+                        help='Print a line of per-stage timings and counters every this many seconds.')
     args = parser.parse_args()
 
+    # The modes are picked in this order below; each one can't honour the options listed for it
+    ignored_by_mode = [
+        ('--servers', ['--serve', '--pipeline', '--events', '--cluster', '--once']),
+        ('--serve', ['--export', '--pipeline', '--cluster', '--once']),
+        ('--export', ['--pipeline', '--cluster']),
+    ]
+    def given(option):
+        value = getattr(args, option[2:])
+        return value is not None and value is not False and value != []
+    for mode, options in ignored_by_mode:
+        if given(mode):
+            for option in options:
+                if given(option):
+                    parser.error(f"{option} can't be used with {mode}")
+    if args.once and not args.export:
+        parser.error("--once only works with --export")
+
+    from logs import setup_logging
+    setup_logging(args.log_level)
+
     print(f"Ignoring applications containing: {args.ignore}")
     print(f"Hiding strings: {args.hide}")
 
+    if args.metrics_port is not None or args.stats_interval:
+        from metrics import metrics
+        metrics.enable()
+        if args.metrics_port is not None:
+            metrics.serve(args.metrics_port)
+        if args.stats_interval:
+            metrics.report_every(args.stats_interval)
+
+    if args.servers:
+        run_hosts(args)
+    elif args.serve is not None:
+        run_server(args)
+    elif args.export:
+        run_headless(args)
+    elif args.pipeline:
+        from pipeline import run_pipeline
+        run_pipeline(args)
+    else:
+        run_window(args)
+
+
+def watch(args, pulse, on_change, wait):
+    # Calls on_change(state) for every change, with wait(seconds) in between
+    from routing import generate_audio_state_json
+    from events import EventStateTracker
+    from fetch import RoutingFetcher
+    from delta import delta_since
+    from metrics import metrics
+    from scheduler import RefreshScheduler
+
+    if args.events:
+        tracker = EventStateTracker(pulse)
+        current_state = tracker.start()
+    else:
+        tracker = None
+        # Lists are fetched off the main thread, so a slow server can't freeze the window
+        fetcher = RoutingFetcher(pulse, timeout=args.fetch_timeout, stale=args.stale_policy)
+        current_state = generate_audio_state_json(pulse, routing=fetcher.fetch(wait))
+
+    scheduler = RefreshScheduler(args.min_interval, args.max_interval, args.debounce)
+    # Last state passed to on_change, and the last one that changed
+    shown = changed = None
+    try:
+        while True:
+            now = time.monotonic()
+            metrics.count('polls')
+            scheduler.polled(current_state["has_changed"], now)
+            if current_state["has_changed"]:
+                metrics.count('changes')
+                changed = current_state
+            if scheduler.due(now):
+                # Several changes since the last update become one, with a delta against what was shown
+                if scheduler.pending > 1 or changed is not current_state:
+                    metrics.count('updates_avoided', scheduler.pending - 1)
+                    changed = delta_since(current_state, shown)
+                on_change(changed)
+                shown = current_state
+                scheduler.updated()
+
+            if tracker is None:
+                wait(scheduler.next_wait(time.monotonic()))
+                current_state = generate_audio_state_json(pulse, previous_state=current_state, routing=fetcher.fetch(wait))
+            else:
+                # Just long enough to keep a window responsive; the poll returns as soon as an event arrives
+                wait(0.05)
+                current_state = tracker.poll(timeout=min(0.1, scheduler.next_wait(time.monotonic())))
+    finally:
+        if tracker is None:
+            fetcher.close()
+        print(scheduler.summary(time.monotonic()))
+
+
+def run_headless(args):
+    import pulsectl
+    from routing import generate_audio_state_json
+    from graph import AudioRoutingGraph
+    from layout import column_layout
+    from export import export_graph
+    from writer import SnapshotWriter, Snapshot
+    from history import StateHistory
+    from metrics import metrics
+
+    routing_graph = AudioRoutingGraph(hide_list=args.hide, ignore_list=args.ignore, only_active=args.active)
+    state = {'G': None, 'pos': None}
+
+    with pulsectl.Pulse('pulseaudio-routing-visualizer') as pulse:
+        if args.once:
+            G = routing_graph.rebuild(generate_audio_state_json(pulse))
+            pos = column_layout(G, None, minimise_crossings=not(args.alpha))
+            snapshot = Snapshot({}, exports={export_format: export_graph(G, export_format, pos, args.text_wrap) for export_format in args.export})
+            if not os.path.exists(args.output_dir):
+                os.makedirs(args.output_dir)
+            snapshot.write_exports(args.output_dir)
+            return
+
+        writer = SnapshotWriter(args.write_queue)
+        metrics.gauge_callback('write_queue_depth', writer.depth)
+        history = StateHistory(args.output_dir, keyframe_interval=args.keyframe_interval, compress=args.compress_history)
+
+        def on_change(current_state):
+            with metrics.timer('graph'):
+                if state['G'] is None:
+                    state['G'] = routing_graph.rebuild(current_state)
+                else:
+                    routing_graph.apply(current_state, current_state["delta"])
+            G = state['G']
+            metrics.gauge('nodes', len(G))
+            metrics.gauge('edges', G.number_of_edges())
+            with metrics.timer('layout'):
+                state['pos'] = column_layout(G, state['pos'], minimise_crossings=not(args.alpha))
+            # Serialize now, write later: the graph keeps changing after this returns
+            with metrics.timer('export'):
+                exports = {export_format: export_graph(G, export_format, state['pos'], args.text_wrap) for export_format in args.export}
+            snapshot = Snapshot(current_state, exports=exports)
+            writer.submit(lambda: snapshot.write(args.output_dir, history))
+
+        try:
+            watch(args, pulse, on_change, time.sleep)
+        finally:
+            writer.close()
+
+
+def run_server(args):
+    import pulsectl
+    from graph import AudioRoutingGraph
+    from writer import SnapshotWriter, Snapshot
+    from history import StateHistory
+    from server import GraphStream, serve
+
+    routing_graph = AudioRoutingGraph(hide_list=args.hide, ignore_list=args.ignore, only_active=args.active)
+    stream = GraphStream()
+    serve(stream, args.serve, args.serve_host)
+    view = {'G': None}
+
+    writer = SnapshotWriter(args.write_queue)
+    history = StateHistory(args.output_dir, keyframe_interval=args.keyframe_interval, compress=args.compress_history)
+
+    def on_change(current_state):
+        # Clients get what changed in the graph, not in the state, so filtered nodes stay out
+        if view['G'] is None:
+            view['G'] = routing_graph.rebuild(current_state)
+            stream.publish_graph(view['G'])
+        else:
+            stream.publish(routing_graph.G, routing_graph.apply(current_state, current_state["delta"]))
+        snapshot = Snapshot(current_state)
+        writer.submit(lambda: snapshot.write(args.output_dir, history))
+
+    with pulsectl.Pulse('pulseaudio-routing-visualizer') as pulse:
+        try:
+            watch(args, pulse, on_change, time.sleep)
+        finally:
+            writer.close()
+
+
+def run_hosts(args):
+    from graph import AudioRoutingGraph
+    from layout import column_layout
+    from export import export_graph
+    from writer import SnapshotWriter, Snapshot
+    from hosts import HostPool, host_directory
+
+    pool = HostPool(args.servers, args.output_dir, keyframe_interval=args.keyframe_interval, compress=args.compress_history)
+    writer = SnapshotWriter(args.write_queue * len(pool.hosts))
+    # Host -> (graph, positions), only kept when exporting
+    views = {}
+
+    def on_change(host, current_state):
+        exports = {}
+        if args.export:
+            if host not in views:
+                routing_graph = AudioRoutingGraph(hide_list=args.hide, ignore_list=args.ignore, only_active=args.active)
+                routing_graph.rebuild(current_state)
+                views[host] = (routing_graph, None)
+            else:
+                views[host][0].apply(current_state, current_state["delta"])
+            routing_graph = views[host][0]
+            pos = column_layout(routing_graph.G, views[host][1], minimise_crossings=not(args.alpha))
+            views[host] = (routing_graph, pos)
+            exports = {export_format: export_graph(routing_graph.G, export_format, pos, args.text_wrap) for export_format in args.export}
+        snapshot = Snapshot(current_state, exports=exports)
+        directory = host_directory(args.output_dir, host.server)
+        writer.submit(lambda: snapshot.write(directory, host.history))
+
+    try:
+        while True:
+            start = time.monotonic()
+            for host, current_state in pool.poll(timeout=args.fetch_timeout):
+                logger.info("%s: %d added, %d removed, %d modified", host.server,
+                            len(current_state['delta']['nodes']['added']), len(current_state['delta']['nodes']['removed']),
+                            len(current_state['delta']['nodes']['modified']))
+                on_change(host, current_state)
+            time.sleep(max(0, 1 - (time.monotonic() - start)))
+    finally:
+        pool.close()
+        writer.close()
+
+
+def run_window(args):
+    import pulsectl
+    import matplotlib.pyplot as plt
+    from graph import AudioRoutingGraph
+    from layout import column_layout
+    from render import RetainedRenderer
+    from writer import SnapshotWriter, Snapshot
+    from history import StateHistory
+    from metrics import metrics
+    from lod import cluster_graph, cluster_id, cluster_key
+
     plt.ion()
     # Double the size of the initial window
     fig, ax = plt.subplots(figsize=(20, 10))
-    pos = None
-    last_update_time = datetime.now()
-    previous_state = None
+    renderer = RetainedRenderer(fig, ax, text_wrap=args.text_wrap)
+    view = {'G': None, 'pos': None, 'expanded': set()}
 
-    with pulsectl.Pulse('pulseaudio-routing-visualizer') as pulse:
-        while True:
-            current_state = generate_audio_state_json(pulse, previous_state=previous_state)
+    def shown():
+        # What gets drawn: the routing graph, or a clustered copy of it
+        if not args.cluster:
+            return view['G']
+        return cluster_graph(view['G'], args.cluster, args.cluster_min, view['expanded'])
 
-            # Only update the graph if the audio configuration changes
-            if current_state["has_changed"]:
-                # Save the state to a file
-                state_file_path = save_audio_state_to_file(current_state, './graphs')
-                print(f"Saved state to {state_file_path}")
+    def redraw(pos=None):
+        D = shown()
+        view['pos'] = renderer.draw(D, column_layout(D, pos, minimise_crossings=not(args.alpha)), datetime.now())
+
+    # Press 'r' in the window to recompute the whole layout
+    def on_key(event):
+        if event.key == 'r' and view['G'] is not None:
+            redraw()
+    fig.canvas.mpl_connect('key_press_event', on_key)
+
+    # Click a cluster to show its streams, or one of its streams to fold them back
+    def on_pick(event):
+        if event.artist is not renderer.nodes or view['G'] is None or not len(event.ind):
+            return
+        node = renderer.node_at(event.ind[0])
+        if node.startswith('cluster:'):
+            view['expanded'].add(node)
+        elif node in view['G']:
+            data = view['G'].nodes[node]
+            key = cluster_key(data, args.cluster)
+            if key is None or cluster_id(data['type'], key) not in view['expanded']:
+                return
+            view['expanded'].discard(cluster_id(data['type'], key))
+        redraw(view['pos'])
+    if args.cluster:
+        fig.canvas.mpl_connect('pick_event', on_pick)
 
-                G = create_audio_routing_graph(current_state, text_wrap=args.text_wrap, hide_list=args.hide, ignore_list=args.ignore, only_active=args.active)
+    routing_graph = AudioRoutingGraph(hide_list=args.hide, ignore_list=args.ignore, only_active=args.active)
 
-                pos = update_graph( G, ax, fig, pos, datetime.now(), only_active=args.active, spring_layout=not(args.alpha))
-                save_graph_figure(G, pos, './graphs')
+    # Disk writes happen on a background thread, so the live view never waits for them
+    writer = SnapshotWriter(args.write_queue)
+    metrics.gauge_callback('write_queue_depth', writer.depth)
+    history = StateHistory(args.output_dir, keyframe_interval=args.keyframe_interval, compress=args.compress_history)
 
-                previous_state = current_state
-                last_update_time = datetime.now()
+    def on_change(current_state):
+        # Build the graph once, then only apply what changed
+        with metrics.timer('graph'):
+            if view['G'] is None:
+                view['G'] = routing_graph.rebuild(current_state)
+            else:
+                routing_graph.apply(current_state, current_state["delta"])
+        metrics.gauge('nodes', len(view['G']))
+        metrics.gauge('edges', view['G'].number_of_edges())
+        with metrics.timer('cluster'):
+            D = shown()
+        with metrics.timer('layout'):
+            pos = column_layout(D, view['pos'], minimise_crossings=not(args.alpha))
+        with metrics.timer('draw'):
+            view['pos'] = renderer.draw(D, pos, datetime.now())
+        metrics.count('redraws')
 
-            # Update every second without bringing the window to the front
-            fig.canvas.start_event_loop(1)
+        # Append the state to the history and save the figure
+        with metrics.timer('capture'):
+            image = renderer.capture()
+            if image is None:
+                renderer.save_figure(args.output_dir)
+        snapshot = Snapshot(current_state, image)
+        writer.submit(lambda: snapshot.write(args.output_dir, history))
+
+    with pulsectl.Pulse('pulseaudio-routing-visualizer') as pulse:
+        try:
+            # Update without bringing the window to the front
+            watch(args, pulse, on_change, fig.canvas.start_event_loop)
+        finally:
+            writer.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""Measure the memory held by the audio state and allocated per poll.
+
+Polls a FakePulse server with a little churn between polls and reports, per
+size: the memory retained by one state, the peak allocated while producing
+the next one, and the time per poll. Run it on two revisions to compare.
+"""
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fakepulse import FakePulse
+from routing import generate_audio_state_json
+
+
+def measure(nodes, polls, churn):
+    pulse = FakePulse(nodes)
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    state = generate_audio_state_json(pulse)
+    retained = tracemalloc.get_traced_memory()[0] - before
+
+    peaks = []
+    start = time.perf_counter()
+    for _ in range(polls):
+        pulse.change(churn)
+        baseline = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        state = generate_audio_state_json(pulse, previous_state=state)
+        peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+    elapsed = (time.perf_counter() - start) / polls
+    tracemalloc.stop()
+    return retained, sum(peaks) / len(peaks), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--polls', type=int, default=20)
+    parser.add_argument('--churn', type=float, default=0.01)
+    args = parser.parse_args()
+
+    for nodes in args.sizes:
+        retained, peak, elapsed = measure(nodes, args.polls, args.churn)
+        print(f"{nodes:>6} nodes: state {retained / 1024:9.0f} KiB, "
+              f"allocated per poll {peak / 1024:9.0f} KiB, {elapsed * 1000:8.1f} ms per poll (traced)")
+
+
+if __name__ == "__main__":
+    main()
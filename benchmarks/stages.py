@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""Time each stage of the visualiser on synthetic PulseAudio states.
+
+Builds a FakePulse server per size, applies churn between runs and records
+the median and minimum time of every stage in a JSON file, so regressions in
+the paths that scale with the number of nodes show up as numbers.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+from fakepulse import FakePulse
+from routing import generate_audio_state_json
+from events import EventStateTracker
+from graph import AudioRoutingGraph, create_audio_routing_graph, update_graph, save_graph_figure
+from layout import column_layout
+from render import RetainedRenderer
+from export import to_svg
+
+
+def timed(fn, *args, **kwargs):
+    # Some stages print status lines; time them, but keep the terminal for the results
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        return time.perf_counter() - start, result
+
+
+def bench_size(nodes, churn, repeat, draw, output_dir):
+    times = {}
+
+    def record(stage, seconds):
+        times.setdefault(stage, []).append(seconds)
+
+    pulse = FakePulse(nodes)
+    state = timed(generate_audio_state_json, pulse)[1]
+    routing_graph = AudioRoutingGraph()
+    G = timed(routing_graph.rebuild, state)[1]
+    pos = column_layout(G)
+    tracker = EventStateTracker(FakePulse(nodes))
+    timed(tracker.start)
+
+    if draw:
+        fig, ax = plt.subplots(figsize=(20, 10))
+        renderer = RetainedRenderer(fig, ax)
+        timed(renderer.draw, G, pos, datetime.now())
+
+    for _ in range(repeat):
+        pulse.change(churn)
+        tracker.pulse.change(churn)
+
+        seconds, new_state = timed(generate_audio_state_json, pulse, previous_state=state)
+        record('generate_audio_state_json', seconds)
+        record('event_poll', timed(tracker.poll, 0)[0])
+        record('create_audio_routing_graph', timed(create_audio_routing_graph, new_state)[0])
+        record('graph_apply_delta', timed(routing_graph.apply, new_state, new_state['delta'])[0])
+        state = new_state
+
+        record('layout_full', timed(column_layout, G)[0])
+        seconds, pos = timed(column_layout, G, pos)
+        record('layout_incremental', seconds)
+        record('export_svg', timed(to_svg, G, pos)[0])
+
+        if draw:
+            full_fig, full_ax = plt.subplots(figsize=(20, 10))
+            record('update_graph', timed(lambda: (update_graph(G, full_ax, full_fig, pos, datetime.now()), full_fig.canvas.draw()))[0])
+            plt.close(full_fig)
+            record('retained_draw', timed(renderer.draw, G, pos, datetime.now())[0])
+            plt.figure(fig.number)
+            record('save_graph_figure', timed(save_graph_figure, G, pos, output_dir)[0])
+
+    if draw:
+        plt.close(fig)
+
+    return [
+        {'stage': stage, 'nodes': nodes, 'graph_nodes': len(G), 'graph_edges': G.number_of_edges(),
+         'churn': churn, 'repeat': len(samples),
+         'median_s': statistics.median(samples), 'min_s': min(samples)}
+        for stage, samples in times.items()
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000, 10000],
+                        help='Numbers of PulseAudio objects to simulate.')
+    parser.add_argument('--churn', type=float, nargs='+', default=[0.01, 0.1],
+                        help='Fractions of the streams changed between runs.')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Runs per size and churn rate.')
+    parser.add_argument('--max_draw_nodes', type=int, default=1000,
+                        help='Skip the matplotlib stages above this size.')
+    parser.add_argument('--output', default='benchmarks/results.json',
+                        help='Where to write the results.')
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as output_dir:
+        for nodes in args.sizes:
+            for churn in args.churn:
+                rows = bench_size(nodes, churn, args.repeat, nodes <= args.max_draw_nodes, output_dir)
+                for row in rows:
+                    print(f"{row['stage']:<28} {nodes:>6} nodes  churn {churn:<5} {row['median_s'] * 1000:10.2f} ms")
+                results.extend(rows)
+
+    with open(args.output, 'w') as f:
+        json.dump({
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'results': results,
+        }, f, indent=1)
+    print(f"Saved results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
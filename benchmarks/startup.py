@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""Startup-time budget for the CLI, measured with `python -X importtime`.
+
+Fails (exit status 1) when `audio_routing_visualiser.py --help` or
+`audio_routing_visualiser.py query --help` spends more than the budget
+importing modules, or when a code path imports heavy modules it doesn't
+need: --help needs none of them, headless exports need networkx but not the
+plotting stack.
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PLOTTING = ('matplotlib', 'numpy')
+HEAVY_MODULES = PLOTTING + ('networkx', 'pulsectl')
+
+
+def import_times(args):
+    result = subprocess.run([sys.executable, '-X', 'importtime'] + args, cwd=ROOT,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _, module = line[len('import time:'):].split('|')
+        times[module.strip()] = int(self_us)
+    return times
+
+
+def check(name, args, budget_ms, forbidden):
+    times = import_times(args)
+    total_ms = sum(times.values()) / 1000
+    heavy = sorted({module.split('.')[0] for module in times} & set(forbidden))
+    ok = (budget_ms is None or total_ms <= budget_ms) and not heavy
+    budget = f" (budget {budget_ms} ms)" if budget_ms is not None else ""
+    print(f"{'ok' if ok else 'FAIL'}: {name}: {total_ms:.1f} ms importing {len(times)} modules{budget}")
+    if heavy:
+        print(f"  imports heavy modules: {', '.join(heavy)}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--budget_ms', type=float, default=100,
+                        help='Maximum time spent importing modules for --help.')
+    args = parser.parse_args()
+
+    results = [
+        check('--help', ['audio_routing_visualiser.py', '--help'], args.budget_ms, HEAVY_MODULES),
+        check('query --help', ['audio_routing_visualiser.py', 'query', '--help'], args.budget_ms, HEAVY_MODULES),
+        check('headless export', ['-c', 'import export'], None, PLOTTING),
+    ]
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+NODE_KEYS = ('sinks', 'sources', 'sink_inputs', 'source_outputs')
+
+# Connection list -> (stream field, device field, device state key)
+CONNECTION_KEYS = {
+    'sink_inputs': ('input', 'sink', 'sinks'),
+    'source_outputs': ('output', 'source', 'sources'),
+}
+
+
+def node_id(key, idx):
+    # Same naming as the graph nodes, e.g. "sink_inputs_996"
+    return key + "_" + str(idx)
+
+
+def fingerprint(record):
+    return hash((record['active'], record['type'], record['label'], record['state'],
+                 frozenset(record['additional_info'].items())))
+
+
+def state_fingerprints(state, previous_state=None):
+    previous = (previous_state or {}).get("fingerprints")
+    fingerprints = {}
+    for key in NODE_KEYS:
+        previous_records = previous_state[key] if previous else {}
+        previous_fps = previous[key] if previous else {}
+        fps = {}
+        for idx, record in state[key].items():
+            # Records shared with the previous state (event mode) keep their fingerprint
+            if previous_records.get(idx) is record:
+                fps[idx] = previous_fps[idx]
+            else:
+                fps[idx] = fingerprint(record)
+        fingerprints[key] = fps
+
+    fingerprints["connections"] = {
+        node_id(key, conn[from_key]): node_id(device_key, conn[to_key])
+        for key, (from_key, to_key, device_key) in CONNECTION_KEYS.items()
+        for conn in state["connections"][key]
+    }
+    return fingerprints
+
+
+def diff_states(state, previous_state=None):
+    """Fingerprint `state` and compare it with `previous_state`.
+
+    Stores the fingerprints in state["fingerprints"] and returns the delta:
+    added/removed/modified nodes as (key, idx) and added/removed edges as
+    (from_id, to_id) graph node ids.
+    """
+    fingerprints = state_fingerprints(state, previous_state)
+    state["fingerprints"] = fingerprints
+    if previous_state is not None and "fingerprints" not in previous_state:
+        previous_state = dict(previous_state, fingerprints=state_fingerprints(previous_state))
+    previous = previous_state["fingerprints"] if previous_state is not None else None
+
+    delta = empty_delta()
+
+    for key in NODE_KEYS:
+        fps = fingerprints[key]
+        previous_fps = previous[key] if previous else {}
+        for idx, fp in fps.items():
+            if idx not in previous_fps:
+                delta["nodes"]["added"].append((key, idx))
+            elif previous_fps[idx] != fp:
+                delta["nodes"]["modified"].append((key, idx))
+        for idx in previous_fps:
+            if idx not in fps:
+                delta["nodes"]["removed"].append((key, idx))
+
+    connections = fingerprints["connections"]
+    previous_connections = previous["connections"] if previous else {}
+    for from_id, to_id in connections.items():
+        if previous_connections.get(from_id) != to_id:
+            delta["edges"]["added"].append((from_id, to_id))
+    for from_id, to_id in previous_connections.items():
+        if connections.get(from_id) != to_id:
+            delta["edges"]["removed"].append((from_id, to_id))
+
+    return delta
+
+
+def empty_delta():
+    return {
+        "nodes": {"added": [], "removed": [], "modified": []},
+        "edges": {"added": [], "removed": []},
+    }
+
+
+def has_changes(delta):
+    return any(delta["nodes"].values()) or any(delta["edges"].values())
+
+
+def changed_items(delta):
+    items = {key: [] for key in NODE_KEYS}
+    for key, idx in delta["nodes"]["added"] + delta["nodes"]["modified"]:
+        items[key].append(idx)
+    return items
+
+
+def record_delta(state, delta):
+    state["delta"] = delta
+    state["has_changed"] = has_changes(delta)
+    state["changed_items"] = changed_items(delta)
+    return state
+
+
+def delta_since(state, previous_state):
+    # Copy of `state` whose delta is against an older state, e.g. the last one drawn
+    state = dict(state)
+    return record_delta(state, diff_states(state, previous_state))
@@ -0,0 +1,110 @@
+import pulsectl
+from delta import diff_states, empty_delta, record_delta
+from metrics import metrics
+from routing import get_audio_routing, get_node_data, fetch_node_state, label_loopbacks
+
+# Subscription facility -> (state key, node type, introspection call for a single object)
+FACILITIES = {
+    'sink': ('sinks', 'sink', 'sink_info'),
+    'source': ('sources', 'source', 'source_info'),
+    'sink_input': ('sink_inputs', 'sink_input', 'sink_input_info'),
+    'source_output': ('source_outputs', 'source_output', 'source_output_info'),
+}
+
+# Streams carry their connection: sink input -> sink, source output -> source
+LINKS = {
+    'sink_inputs': ('input', 'sink'),
+    'source_outputs': ('output', 'source'),
+}
+
+
+class EventStateTracker:
+    """Keeps the audio state in memory and updates it from PulseAudio subscription events.
+
+    Only the object named by an event is re-fetched, instead of listing every
+    sink, source and stream on each tick.
+    """
+
+    def __init__(self, pulse):
+        self.pulse = pulse
+        self.nodes = {key: {} for key, _, _ in FACILITIES.values()}
+        self.links = {key: {} for key in LINKS}
+        self.pending = []
+        self.previous = None
+
+    def start(self):
+        # One full fetch to seed the state, then rely on events
+        for (key, node_type, _), objects in zip(FACILITIES.values(), get_audio_routing(self.pulse)):
+            for obj in objects:
+                self._store(key, node_type, obj)
+
+        self.pulse.event_mask_set(*FACILITIES)
+        self.pulse.event_callback_set(self._on_event)
+
+        state = self.state()
+        state["has_changed"] = True
+        return state
+
+    def _on_event(self, ev):
+        # No pulse calls are allowed inside the callback: queue the event and leave the loop
+        self.pending.append((fetch_node_state(ev.facility), fetch_node_state(ev.t), ev.index))
+        raise pulsectl.PulseLoopStop
+
+    def _store(self, key, node_type, obj):
+        record = get_node_data(obj, node_type, self.nodes[key].get(obj.index))
+        link = getattr(obj, LINKS[key][1], None) if key in LINKS else None
+        if self.nodes[key].get(obj.index) is record and self.links.get(key, {}).get(obj.index) == link:
+            return False
+        self.nodes[key][obj.index] = record
+        if key in LINKS:
+            self.links[key][obj.index] = link
+        return True
+
+    def _remove(self, key, index):
+        if key in LINKS:
+            self.links[key].pop(index, None)
+        return self.nodes[key].pop(index, None) is not None
+
+    def _apply(self, facility, event_type, index):
+        if facility not in FACILITIES:
+            return False
+        key, node_type, info = FACILITIES[facility]
+        if event_type == 'remove':
+            return self._remove(key, index)
+        try:
+            obj = getattr(self.pulse, info)(index)
+        except pulsectl.PulseIndexError:
+            # Gone again before we could look at it
+            return self._remove(key, index)
+        return self._store(key, node_type, obj)
+
+    def poll(self, timeout=1):
+        self.pulse.event_listen(timeout=timeout)
+
+        changed = False
+        while self.pending:
+            events, self.pending = self.pending, []
+            metrics.count('events', len(events))
+            with metrics.timer('apply_events'):
+                for facility, event_type, index in events:
+                    changed = self._apply(facility, event_type, index) or changed
+            # Pick up anything that arrived while we were fetching, so a burst becomes one update
+            self.pulse.event_listen(timeout=0.001)
+
+        if not changed and self.previous is not None:
+            # Nothing to rebuild: the previous state's nodes, with nothing changed since
+            return record_delta(dict(self.previous), empty_delta())
+        return self.state()
+
+    def state(self):
+        state = {key: dict(nodes) for key, nodes in self.nodes.items()}
+        state["connections"] = {
+            key: [{from_key: idx, to_key: target} for idx, target in self.links[key].items()]
+            for key, (from_key, to_key) in LINKS.items()
+        }
+        with metrics.timer('diff'):
+            label_loopbacks(state)
+            # Untouched records are shared with the previous state, so only changed ones get re-hashed
+            record_delta(state, diff_states(state, self.previous))
+        self.previous = state
+        return state
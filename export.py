@@ -0,0 +1,114 @@
+import json
+from textwrap import fill
+from xml.sax.saxutils import escape
+from graph import column_labels, display_edges, edge_color, node_color, node_size, shortLabel
+from layout import column_layout, x_offset
+
+# Exports are built from the graph alone and never touch matplotlib, so they work
+# on machines without a display and don't pay for importing the plotting stack.
+
+EXPORT_FORMATS = ('svg', 'dot', 'json')
+
+
+def column_positions(G):
+    # Only the column matters for edge direction and colour
+    return {node: (x_offset[data.get('type', 'unknown')], 0) for node, data in G.nodes(data=True)}
+
+
+def to_node_link_json(G, pos=None):
+    nodes = []
+    for node, data in G.nodes(data=True):
+        entry = dict(data, id=node)
+        if pos is not None:
+            entry['x'], entry['y'] = pos[node]
+        nodes.append(entry)
+    data = {
+        'directed': True,
+        'multigraph': False,
+        'graph': {},
+        'nodes': nodes,
+        'links': [{'source': source, 'target': target} for source, target in G.edges],
+    }
+    return json.dumps(data, indent=1)
+
+
+def dot_string(text):
+    return '"' + str(text).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+
+
+def to_dot(G):
+    lines = ['digraph routing {', '  rankdir=LR;', '  node [style=filled, fontname="Helvetica"];']
+    # One rank per column, in the same order as the window
+    for node_type in x_offset:
+        column = [node for node, data in G.nodes(data=True) if data.get('type', 'unknown') == node_type]
+        if column:
+            lines.append('  { rank=same; ' + ' '.join(dot_string(node) for node in column) + ' }')
+    for node, data in G.nodes(data=True):
+        lines.append(f"  {dot_string(node)} [label={dot_string(shortLabel(data.get('label', node)))}, "
+                     f"fillcolor={dot_string(node_color(data))}];")
+    pos = column_positions(G)
+    for source, target in display_edges(G, pos):
+        lines.append(f"  {dot_string(source)} -> {dot_string(target)} [color={dot_string(edge_color(pos, source, target))}];")
+    lines.append('}')
+    return '\n'.join(lines) + '\n'
+
+
+def to_svg(G, pos=None, text_wrap=30, column_width=320, row_height=48, margin=120):
+    if pos is None:
+        pos = column_layout(G)
+    xs = [x for x, _ in pos.values()] or [0]
+    ys = [y for _, y in pos.values()] or [0]
+    top = max(ys)
+    width = int(margin * 2 + column_width * max(max(xs), 3))
+    height = int(margin * 2 + row_height * (top - min(ys)))
+
+    def xy(node):
+        x, y = pos[node]
+        return margin + x * column_width, margin + (top - y) * row_height
+
+    edges = display_edges(G, pos)
+    colors = sorted({edge_color(pos, source, target) for source, target in edges})
+
+    out = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+           f'font-family="sans-serif" viewBox="0 0 {width} {height}">', '<defs>']
+    for color in colors:
+        out.append(f'<marker id="arrow-{color}" viewBox="0 0 10 10" refX="10" refY="5" markerWidth="8" '
+                   f'markerHeight="8" orient="auto-start-reverse"><path d="M0,0L10,5L0,10z" fill="{color}"/></marker>')
+    out.append('</defs>')
+
+    for label, x in column_labels:
+        cx = margin + x * column_width
+        out.append(f'<line x1="{cx}" y1="0" x2="{cx}" y2="{height}" stroke="gray" stroke-dasharray="4 4" stroke-width="0.5"/>')
+        for i, line in enumerate(label.split('\n')):
+            out.append(f'<text x="{cx}" y="{20 + i * 16}" text-anchor="middle" font-size="12">{escape(line)}</text>')
+
+    for source, target in edges:
+        (x1, y1), (x2, y2) = xy(source), xy(target)
+        # Same curvature as matplotlib's arc3 connection style with rad=0.2
+        cx, cy = (x1 + x2) / 2 + 0.2 * (y2 - y1), (y1 + y2) / 2 - 0.2 * (x2 - x1)
+        color = edge_color(pos, source, target)
+        out.append(f'<path d="M{x1:.1f},{y1:.1f}Q{cx:.1f},{cy:.1f} {x2:.1f},{y2:.1f}" fill="none" '
+                   f'stroke="{color}" stroke-width="2" marker-end="url(#arrow-{color})"/>')
+
+    for node, data in G.nodes(data=True):
+        x, y = xy(node)
+        radius = node_size(data) ** 0.5 / 2
+        out.append(f'<circle cx="{x:.1f}" cy="{y:.1f}" r="{radius:.1f}" fill="{node_color(data)}"/>')
+        lines = fill(shortLabel(data.get('label', node)), text_wrap).split('\n')
+        out.append(f'<text x="{x:.1f}" y="{y - radius - 4 - 16 * (len(lines) - 1):.1f}" text-anchor="middle" '
+                   f'font-size="14" font-weight="bold">'
+                   + ''.join(f'<tspan x="{x:.1f}" dy="{0 if i == 0 else 16}">{escape(line)}</tspan>' for i, line in enumerate(lines))
+                   + '</text>')
+
+    out.append('</svg>')
+    return '\n'.join(out) + '\n'
+
+
+def export_graph(G, export_format, pos=None, text_wrap=30):
+    if export_format == 'svg':
+        return to_svg(G, pos, text_wrap=text_wrap)
+    if export_format == 'dot':
+        return to_dot(G)
+    if export_format == 'json':
+        return to_node_link_json(G, pos)
+    raise ValueError(f"Unknown export format: {export_format}")
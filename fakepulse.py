@@ -0,0 +1,154 @@
+import random
+from types import SimpleNamespace
+import pulsectl
+
+# Stand-in for pulsectl.Pulse serving a synthetic PulseAudio server, for benchmarks
+# and for trying things out without a sound server.
+
+APPLICATIONS = ['Firefox', 'Chromium', 'Spotify', 'Zoom', 'OBS', 'mpv', 'Discord', 'Jitsi Meet',
+                'Audacity', 'VLC', 'Slack', 'Teams', 'Rhythmbox', 'Speech Dispatcher', 'GNOME Settings']
+
+
+class FakePulse:
+    """Synthetic server with sinks, sources, streams, monitors and loopbacks.
+
+    Roughly: 10% sinks (each with its monitor source), 5% other sources, 5%
+    loopback stream pairs, the rest playback and recording streams with
+    realistic proplists. change() mutates the server and queues the matching
+    subscription events for event_listen().
+    """
+
+    def __init__(self, nodes=100, seed=0, properties=30):
+        self.random = random.Random(seed)
+        self.properties = properties
+        self.next_index = 1
+        self.objects = {'sink': {}, 'source': {}, 'sink_input': {}, 'source_output': {}}
+        self.events = []
+        self.callback = None
+
+        sinks = max(1, nodes // 10)
+        sources = max(1, nodes // 20)
+        loopbacks = nodes // 40
+        streams = max(0, nodes - 2 * sinks - sources - 2 * loopbacks)
+        for i in range(sinks):
+            self.add_sink(f"Output {i}")
+        for i in range(sources):
+            self.add('source', f"Input {i}", {'device.class': 'sound'})
+        for _ in range(loopbacks):
+            self.add_loopback()
+        for _ in range(streams):
+            self.add_stream()
+        self.events = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        pass
+
+    def new_index(self):
+        self.next_index += 1
+        return self.next_index
+
+    def state(self):
+        return pulsectl.PulseStateEnum.running if self.random.random() < 0.5 else pulsectl.PulseStateEnum.idle
+
+    def proplist(self, extra):
+        proplist = {f"x.property.{i}": f"value {self.random.randint(0, 9)}" for i in range(self.properties)}
+        proplist.update(extra)
+        return proplist
+
+    def add(self, facility, description, proplist, **links):
+        index = self.new_index()
+        obj = SimpleNamespace(index=index, name=description.lower().replace(' ', '_'), description=description,
+                              proplist=self.proplist(proplist), state=self.state(), **links)
+        self.objects[facility][index] = obj
+        self.events.append(SimpleNamespace(facility=facility, t='new', index=index))
+        return obj
+
+    def add_sink(self, description):
+        sink = self.add('sink', description, {'device.class': 'sound'})
+        self.add('source', f"Monitor of {description}", {'device.class': 'monitor'})
+        return sink
+
+    def add_stream(self):
+        app = self.random.choice(APPLICATIONS)
+        proplist = {'application.name': app, 'application.process.id': str(self.random.randint(1000, 99999)),
+                    'media.name': f"{app} audio"}
+        if self.random.random() < 0.7:
+            return self.add('sink_input', app, proplist, sink=self.random.choice(list(self.objects['sink'])))
+        return self.add('source_output', app, proplist, source=self.random.choice(list(self.objects['source'])))
+
+    def add_loopback(self):
+        # module-loopback streams have no application.name; their label comes from the description
+        source = self.objects['source'][self.random.choice(list(self.objects['source']))]
+        sink = self.objects['sink'][self.random.choice(list(self.objects['sink']))]
+        self.add('source_output', f"Loopback to {sink.description}", {'media.name': 'Loopback'}, source=source.index)
+        self.add('sink_input', f"Loopback from {source.description}", {'media.name': 'Loopback'}, sink=sink.index)
+
+    def change(self, rate=0.01):
+        # Replace, re-route or toggle about `rate` of the streams
+        streams = [(facility, index) for facility in ('sink_input', 'source_output') for index in self.objects[facility]]
+        for _ in range(max(1, int(len(streams) * rate))):
+            action = self.random.random()
+            if action < 0.3 and streams:
+                facility, index = streams.pop(self.random.randrange(len(streams)))
+                del self.objects[facility][index]
+                self.events.append(SimpleNamespace(facility=facility, t='remove', index=index))
+                self.add_stream()
+            elif streams:
+                facility, index = self.random.choice(streams)
+                obj = self.objects[facility][index]
+                if action < 0.6 and facility == 'sink_input':
+                    obj.sink = self.random.choice(list(self.objects['sink']))
+                else:
+                    obj.state = self.state()
+                self.events.append(SimpleNamespace(facility=facility, t='change', index=index))
+
+    def sink_list(self):
+        return list(self.objects['sink'].values())
+
+    def source_list(self):
+        return list(self.objects['source'].values())
+
+    def sink_input_list(self):
+        return list(self.objects['sink_input'].values())
+
+    def source_output_list(self):
+        return list(self.objects['source_output'].values())
+
+    def info(self, facility, index):
+        try:
+            return self.objects[facility][index]
+        except KeyError:
+            raise pulsectl.PulseIndexError(index)
+
+    def sink_info(self, index):
+        return self.info('sink', index)
+
+    def source_info(self, index):
+        return self.info('source', index)
+
+    def sink_input_info(self, index):
+        return self.info('sink_input', index)
+
+    def source_output_info(self, index):
+        return self.info('source_output', index)
+
+    def event_mask_set(self, *masks):
+        pass
+
+    def event_callback_set(self, callback):
+        self.callback = callback
+
+    def event_listen(self, timeout=None):
+        # Hands out queued events until the callback stops the loop; never waits
+        while self.events:
+            event = self.events.pop(0)
+            try:
+                self.callback(event)
+            except pulsectl.PulseLoopStop:
+                return
@@ -0,0 +1,128 @@
+import asyncio
+import concurrent.futures
+import logging
+import threading
+import time
+from metrics import metrics
+from routing import get_audio_routing
+
+# pulsectl-asyncio (in requirements.txt) sends the four list requests together on
+# one connection. Without it they run one after the other on a worker thread.
+try:
+    import pulsectl_asyncio
+except ImportError:
+    pulsectl_asyncio = None
+
+logger = logging.getLogger(__name__)
+
+# Times a fetch is repeated when a stream points at a device missing from the lists
+CONSISTENCY_RETRIES = 3
+
+# Longest single wait() while a fetch is in flight, so a window stays responsive
+WAIT_SLICE = 0.05
+
+
+class FetchTimeout(TimeoutError):
+    pass
+
+
+def consistent(routing):
+    # Every stream's device is in the same snapshot; a device can appear or vanish between two requests
+    sinks, sources, sink_inputs, source_outputs = routing
+    sink_ids = {sink.index for sink in sinks}
+    source_ids = {source.index for source in sources}
+    return (all(sink_input.sink in sink_ids for sink_input in sink_inputs)
+            and all(source_output.source in source_ids for source_output in source_outputs))
+
+
+class RoutingFetcher:
+    """Fetches sinks, sources and streams off the main thread, with a timeout.
+
+    fetch() waits at most `timeout` seconds from when the request went out,
+    calling wait() in short slices so a window can keep handling events. If
+    PulseAudio hasn't answered by then, the request stays in flight and, with
+    the "keep" policy, the last complete snapshot is returned straight away
+    until it does; with "fail" a FetchTimeout is raised.
+    """
+
+    def __init__(self, pulse=None, timeout=2.0, stale='keep', client_name='pulseaudio-routing-visualizer'):
+        self.timeout = timeout
+        self.stale = stale
+        self.last = None
+        self.pending = None
+        self.requested = None
+        self.stale_fetches = 0
+
+        if pulsectl_asyncio is not None:
+            self.loop = asyncio.new_event_loop()
+            threading.Thread(target=self.loop.run_forever, name='pulse-fetch', daemon=True).start()
+            # Same server as the blocking connection, not the default one
+            self.pulse = pulsectl_asyncio.PulseAsync(client_name, server=getattr(pulse, 'server', None))
+            asyncio.run_coroutine_threadsafe(self.pulse.connect(), self.loop).result(timeout)
+        else:
+            # The blocking connection is only ever used from the fetch thread, one request at a time
+            self.loop = None
+            self.pulse = pulse
+
+    def request(self):
+        if self.loop is not None:
+            return asyncio.run_coroutine_threadsafe(self.fetch_async(), self.loop)
+        future = concurrent.futures.Future()
+
+        def run():
+            try:
+                future.set_result(self.fetch_blocking())
+            except Exception as e:
+                future.set_exception(e)
+        # A daemon thread rather than an executor, so a list call that never returns can't block exiting
+        threading.Thread(target=run, name='pulse-fetch', daemon=True).start()
+        return future
+
+    @staticmethod
+    async def timed(stage, request):
+        with metrics.timer(stage):
+            return await request
+
+    async def fetch_async(self):
+        for _ in range(CONSISTENCY_RETRIES):
+            routing = tuple(await asyncio.gather(self.timed('list_sinks', self.pulse.sink_list()),
+                                                 self.timed('list_sources', self.pulse.source_list()),
+                                                 self.timed('list_sink_inputs', self.pulse.sink_input_list()),
+                                                 self.timed('list_source_outputs', self.pulse.source_output_list())))
+            if consistent(routing):
+                break
+        return routing
+
+    def fetch_blocking(self):
+        for _ in range(CONSISTENCY_RETRIES):
+            routing = get_audio_routing(self.pulse)
+            if consistent(routing):
+                break
+        return routing
+
+    def fetch(self, wait=time.sleep):
+        # wait(seconds) is called while the request is in flight, e.g. a window's event loop
+        if self.pending is None:
+            self.pending = self.request()
+            self.requested = time.monotonic()
+        with metrics.timer('fetch'):
+            while not self.pending.done():
+                remaining = self.requested + self.timeout - time.monotonic()
+                if remaining <= 0:
+                    if self.stale != 'keep' or self.last is None:
+                        raise FetchTimeout(f"PulseAudio didn't answer within {self.timeout} s")
+                    self.stale_fetches += 1
+                    metrics.count('stale_fetches')
+                    logger.warning("PulseAudio didn't answer within %s s, keeping the last state", self.timeout)
+                    return self.last
+                wait(min(WAIT_SLICE, remaining))
+        pending, self.pending = self.pending, None
+        routing = pending.result()
+        self.last = routing
+        return routing
+
+    def close(self):
+        # A fetch thread still waiting on PulseAudio is a daemon and doesn't hold up exiting
+        if self.loop is not None:
+            self.pulse.close()
+            self.loop.call_soon_threadsafe(self.loop.stop)
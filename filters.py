@@ -0,0 +1,103 @@
+import argparse
+import re
+
+# --hide and --ignore terms compiled into one regex. Plain terms go into a trie,
+# so matching costs about the same for ten terms or a thousand; terms starting
+# with "re:" are regular expressions. Results are cached per label.
+
+REGEX_PREFIX = 're:'
+# Cached labels before the cache is cleared, as stream names come and go
+CACHE_SIZE = 10000
+
+
+def trie_pattern(words):
+    # Regex matching any of the words, longest first, sharing common prefixes
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = True
+    return _trie_node_pattern(trie)
+
+
+def _trie_node_pattern(node):
+    alternatives = []
+    single_chars = []
+    for char in sorted(key for key in node if key):
+        child = _trie_node_pattern(node[char])
+        if child is None:
+            single_chars.append(re.escape(char))
+        else:
+            alternatives.append(re.escape(char) + child)
+    if not alternatives and not single_chars:
+        return None
+
+    only_chars = not alternatives
+    if single_chars:
+        alternatives.append(single_chars[0] if len(single_chars) == 1 else '[' + ''.join(single_chars) + ']')
+    pattern = alternatives[0] if len(alternatives) == 1 else '(?:' + '|'.join(alternatives) + ')'
+    if '' in node:
+        # A word ends here but longer ones carry on
+        pattern = pattern + '?' if only_chars or len(alternatives) > 1 else '(?:' + pattern + ')?'
+    return pattern
+
+
+def filter_term(term):
+    # argparse type for --hide and --ignore: a bad regular expression is a usage error, not a crash
+    if not term.startswith(REGEX_PREFIX):
+        return term
+    expression = term[len(REGEX_PREFIX):]
+    if not expression:
+        raise argparse.ArgumentTypeError(f"{term!r} has no pattern after {REGEX_PREFIX!r}")
+    try:
+        pattern = re.compile(expression)
+    except re.error as error:
+        raise argparse.ArgumentTypeError(f"{term!r} is not a valid regular expression: {error}")
+    if pattern.search('') is not None:
+        raise argparse.ArgumentTypeError(f"{term!r} matches the empty string, so it would match every label")
+    return term
+
+
+def compile_terms(terms):
+    words = [term for term in terms if term and not term.startswith(REGEX_PREFIX)]
+    expressions = [term[len(REGEX_PREFIX):] for term in terms if term.startswith(REGEX_PREFIX)]
+    parts = ([trie_pattern(words)] if words else []) + ['(?:' + expression + ')' for expression in expressions]
+    return re.compile('|'.join(parts)) if parts else None
+
+
+class LabelFilter:
+    """A list of hide or ignore terms, compiled once.
+
+    matches(label) tells whether any term occurs in the label, remove(label)
+    deletes every occurrence, longest match first, in a single pass.
+    """
+
+    def __init__(self, terms=()):
+        self.terms = list(terms)
+        self.pattern = compile_terms(self.terms)
+        self.matched = {}
+        self.removed = {}
+
+    def __bool__(self):
+        return self.pattern is not None
+
+    def matches(self, label):
+        if self.pattern is None:
+            return False
+        result = self.matched.get(label)
+        if result is None:
+            if len(self.matched) >= CACHE_SIZE:
+                self.matched.clear()
+            result = self.matched[label] = self.pattern.search(label) is not None
+        return result
+
+    def remove(self, label):
+        if self.pattern is None:
+            return label
+        result = self.removed.get(label)
+        if result is None:
+            if len(self.removed) >= CACHE_SIZE:
+                self.removed.clear()
+            result = self.removed[label] = self.pattern.sub('', label)
+        return result
@@ -1,137 +1,341 @@
-import matplotlib.pyplot as plt
 import networkx as nx
 import os
 from datetime import datetime
 import re
+import math
+import logging
 from textwrap import fill
+from collections import Counter
+from collections.abc import Mapping
+from layout import column_layout
+from filters import LabelFilter, filter_term
+
+logger = logging.getLogger(__name__)
+
+state_keys = {
+    'sinks': 'Output Devices',
+    'sources': 'Input Devices',
+    'sink_inputs': 'Playback',
+    'source_outputs': 'Recording'
+}
+
+connection_keys = {
+    'sink_inputs': ('input', 'sink'),
+    'source_outputs': ('output', 'source')
+}
+
+
+# Inferred edge patterns, compiled once rather than per pair of nodes
+TRAILING_NODE_ID = re.compile(r'\S+$')
+MONITOR_LABEL = re.compile(r'^Monitor of ')
+LOOPBACK_LABEL = re.compile(r'^\s*(L\d) ')
+
+
+def infer_edges(G, nodes=None, labels=None):
+    # Loopbacks pair with the first matching node, so callers updating a graph in place
+    # pass the nodes in the order a fresh build would have added them
+    allnodes = list(G.nodes) if nodes is None else list(nodes)
+    # Labels end in the node id ("Speakers sinks_12"); match on the part before it.
+    # Callers that cache the stripped labels can pass them in, aligned with the nodes.
+    if labels is None:
+        labels = [TRAILING_NODE_ID.sub('', G.nodes[node].get('label', '')) for node in allnodes]
+
+    # Index node positions by label, for monitors, and by their first two characters,
+    # which is all a loopback tag ("L1") can match
+    by_label = {}
+    by_tag = {}
+    for position, label in enumerate(labels):
+        by_label.setdefault(label, []).append(position)
+        by_tag.setdefault(label[:2], []).append(position)
 
-def create_audio_routing_graph(state, text_wrap=30, hide_list=None, ignore_list=None, only_active=False):
-    if hide_list is None:
-        hide_list = []
-    if ignore_list is None:
-        ignore_list = []
+    edges_to_add = []
+    checkloops = {}
+    # Checked once rather than per edge; with debug logging off nothing below is formatted
+    debug = logger.isEnabledFor(logging.DEBUG)
+
+    for position, node in enumerate(allnodes):
+        node_label = labels[position]
+        targets = []
+        if MONITOR_LABEL.match(node_label):
+            for target in by_label.get(node_label.replace('Monitor of ', ''), []):
+                if target != position:
+                    targets.append((target, 'monitor'))
+
+        loopback = LOOPBACK_LABEL.match(node_label)
+        if loopback and loopback.group(1) not in checkloops:
+            for target in by_tag.get(loopback.group(1), []):
+                if target != position:
+                    targets.append((target, 'loop'))
+                    checkloops[loopback.group(1)] = True
+                    break
+
+        # Monitor edges come before the loop edge for the same target
+        for target, kind in sorted(targets):
+            if debug:
+                if kind == 'monitor':
+                    logger.debug("Monitor connection: %s %s", node, allnodes[target])
+                else:
+                    logger.debug("Loop connection: %s %s (%s / %s)", node, allnodes[target], node_label, labels[target])
+            edges_to_add.append((node, allnodes[target]))
 
-    def is_ignored(node):
-        result = any(ignore_term in node['label'] for ignore_term in ignore_list)
-        # print("perform node check: ", node['label'] , " -> ", result)
-        return result
+    return edges_to_add
 
-    G = nx.DiGraph()
 
-    def add_node(node_id, data):
-        label = get_node_label(data, hide_list)
-        if only_active and data['state'] != 'running':
+def add_connection_edge(G, from_id, to_id, inferred=()):
+    # Edges inferred from labels don't count as existing connections here, as in a fresh
+    # build they are only added after all the connections
+    if from_id in G and to_id in G:
+        if G.has_edge(from_id, to_id) and (from_id, to_id) not in inferred:
+            logger.debug("Spurious edge from %s to %s: already connected", from_id, to_id)
             return False
-        if is_ignored(data):
+        if G.has_edge(to_id, from_id) and (to_id, from_id) not in inferred:
+            logger.debug("Spurious edge from %s to %s: connected the other way", from_id, to_id)
             return False
-        G.add_node(node_id, label=label+" "+str(node_id), type=data.get('type', 'unknown'), active=data.get('active', False))
-        # G.add_node(node_id, label=label, type=data.get('type', 'unknown'), active=data.get('active', False))
-        # print( f"Added node: {node_id}, label: {label}, type: {data.get('type', 'unknown')}")
+        G.add_edge(from_id, to_id)
+        logger.debug("Connection: edge from %s to %s", from_id, to_id)
         return True
+    logger.debug("Spurious edge from %s to %s: node filtered out or missing", from_id, to_id)
+    return False
 
-    node_id_map = {}
-    idx = 0
-
-
-    state_keys = {
-        'sinks': 'Output Devices',
-        'sources': 'Input Devices',
-        'sink_inputs': 'Playback',
-        'source_outputs': 'Recording'
-    }
-
-    for key, description in state_keys.items():
-        for node, data in state[key].items():
-            # print(f"{key} = {description}: ", node)
-            nodekey = key + "_" + str(node)
-            if (add_node(nodekey, data)):
-                node_id_map[nodekey] = idx
-                idx += 1
-
-    # print(node_id_map)
-
-
-    # Adding edges
-    connection_keys = {
-        'sink_inputs': ('input', 'sink'),
-        'source_outputs': ('output', 'source')
-    }
-
-    added_edges = {}
-    # print(f"Connections: {state['connections']}")
-    for key, (from_key, to_key) in connection_keys.items():
-        # print(f"Key: {key}, from_key: {from_key}, to_key: {to_key}")
-        # Key: source_outputs, from_key: output, to_key: source
-        for conn in state['connections'][key]:
-            # print(f" -> Connection: {conn}")
-            #  -> Connection: {'input': 996, 'sink': 23}
-            #  Added edge from sink_inputs_996 to sink_inputs_23
-            from_id = key + "_" + str(conn[from_key])
-            to_id = to_key + "s_" + str(conn[to_key])
-            if from_id is not None and to_id is not None:
-                if from_id in node_id_map and to_id in node_id_map:
-                    if (from_id, to_id) in added_edges:
-                        print( f"Connection: Spurious edge from {from_id} to {to_id}")
-                        continue
-                    if (to_id, from_id) in added_edges:
-                        print(f"Spurious edge from {from_id} to {to_id}")
-                        continue
-                    G.add_edge(from_id, to_id)
-                    added_edges[(from_id, to_id)] = True
-                    print(f"Connection: edge from {from_id} to {to_id}")
-                else:
-                    print(f"Connection: Spurious edge from {from_id} to {to_id}")
-            else:
-                print(f"NOT adding edge from {conn[from_key]} to {conn[to_key]}")
 
-
-    allnodes = list(G.nodes)  # Convert to list to avoid runtime error
-    edges_to_add = []
-    checkloops = {}
-
-    for node in allnodes:
-        for target in allnodes:
-            if node != target:
-                node_label = re.sub(r'\S+$', '', G.nodes[node].get('label', ''))
-                target_label = re.sub(r'\S+$', '', G.nodes[target].get('label', ''))
-                # if 'Monitor of' in node_label and node_label.replace('Monitor of ', '') in target_label:
-                if re.match(r'^Monitor of ', node_label) and node_label.replace('Monitor of ', '') == target_label:
-                    print("Monitor connection: ", node, target)
-                    from_id = node  # Assuming from_id is node
-                    to_id = target  # Assuming to_id is target
-                    edges_to_add.append((from_id, to_id))
+def create_audio_routing_graph(state, text_wrap=30, hide_list=None, ignore_list=None, only_active=False):
+    return AudioRoutingGraph(hide_list, ignore_list, only_active).rebuild(state)
+
+
+class AudioRoutingGraph:
+    """Long-lived routing graph, updated in place from state deltas.
+
+    Display labels are cached per node and only recomputed when the node's
+    label or the hide list changes.
+    """
+
+    def __init__(self, hide_list=None, ignore_list=None, only_active=False):
+        self.G = nx.DiGraph()
+        self.hide_list = list(hide_list) if hide_list else []
+        self.ignore_list = list(ignore_list) if ignore_list else []
+        self.hide = LabelFilter(self.hide_list)
+        self.ignore = LabelFilter(self.ignore_list)
+        self.only_active = only_active
+        # node id -> (state label, display label, display label without the node id)
+        self.labels = {}
+        self.inferred = set()
+        # What edge inference keys on, for the nodes in the graph: the labels monitors point
+        # at ("Speakers" for "Monitor of Speakers") and loopback tags ("L1")
+        self.monitor_stems = Counter()
+        self.loop_tags = Counter()
+
+    def track_label(self, label, count=1):
+        # label: display label without the node id, as infer_edges sees it
+        keys = []
+        if MONITOR_LABEL.match(label):
+            keys.append((self.monitor_stems, label.replace('Monitor of ', '')))
+        loopback = LOOPBACK_LABEL.match(label)
+        if loopback:
+            keys.append((self.loop_tags, loopback.group(1)))
+        for counter, key in keys:
+            counter[key] += count
+            if counter[key] <= 0:
+                del counter[key]
+
+    def track_all(self):
+        self.monitor_stems.clear()
+        self.loop_tags.clear()
+        for node in self.G:
+            self.track_label(self.labels[node][2])
+
+    def takes_part(self, label):
+        # Whether a node with this label can be at either end of an inferred edge
+        return bool(MONITOR_LABEL.match(label) or label in self.monitor_stems
+                    or LOOPBACK_LABEL.match(label) or label[:2] in self.loop_tags)
+
+    def node_label(self, node_id, data):
+        cached = self.labels.get(node_id)
+        if cached is None or cached[0] != data['label']:
+            label = get_node_label(data, self.hide) + " " + str(node_id)
+            cached = (data['label'], label, TRAILING_NODE_ID.sub('', label))
+            self.labels[node_id] = cached
+        return cached
+
+    def node_attributes(self, node_id, data):
+        # Graph attributes for a state record, or None if the node is filtered out
+        if self.only_active and data['state'] != 'running':
+            return None
+        if self.ignore.matches(data['label']):
+            return None
+        attributes = {'label': self.node_label(node_id, data)[1], 'type': data.get('type', 'unknown'), 'active': data.get('active', False)}
+        # What streams can be grouped by when drawing large graphs, see lod.py
+        info = data.get('additional_info') or {}
+        if 'application.name' in info:
+            attributes['application'] = info['application.name']
+        if 'application.process.id' in info:
+            attributes['process'] = info['application.process.id']
+        return attributes
+
+    def state_order(self, state):
+        # Graph nodes in the order a fresh build adds them
+        return [key + "_" + str(idx) for key in state_keys for idx in state[key] if key + "_" + str(idx) in self.G]
+
+    def rebuild(self, state):
+        self.G = G = nx.DiGraph()
+        self.inferred = set()
+
+        for key, description in state_keys.items():
+            for node, data in state[key].items():
+                # print(f"{key} = {description}: ", node)
+                nodekey = key + "_" + str(node)
+                attributes = self.node_attributes(nodekey, data)
+                if attributes is not None:
+                    G.add_node(nodekey, **attributes)
+
+        # Adding edges
+        # print(f"Connections: {state['connections']}")
+        spurious = 0
+        for key, (from_key, to_key) in connection_keys.items():
+            # Key: source_outputs, from_key: output, to_key: source
+            for conn in state['connections'][key]:
+                #  -> Connection: {'input': 996, 'sink': 23}
+                #  Added edge from sink_inputs_996 to sinks_23
+                from_id = key + "_" + str(conn[from_key])
+                to_id = to_key + "s_" + str(conn[to_key])
+                if not add_connection_edge(G, from_id, to_id):
+                    spurious += 1
+
+        self.track_all()
+        self.update_inferred_edges(state)
+        logger.info("Built graph: %d nodes, %d edges (%d inferred), %d spurious connections",
+                    len(G), G.number_of_edges(), len(self.inferred), spurious)
+
+        # print(f"Nodes in graph: {G.nodes(data=True)}")
+        # print(f"Edges in graph: {G.edges(data=True)}")
+
+        return G
+
+    def update_inferred_edges(self, state):
+        # Monitor and loopback edges are not in the connection lists and are worked out from
+        # labels. Only the difference to the previous inference is applied to the graph.
+        G = self.G
+        nodes = self.state_order(state)
+        wanted = set(infer_edges(G, nodes, [self.labels[node][2] for node in nodes]))
+        removed, added = [], []
+        for edge in self.inferred - wanted:
+            if G.has_edge(*edge):
+                G.remove_edge(*edge)
+                removed.append(edge)
+        self.inferred &= wanted
+        for edge in wanted - self.inferred:
+            if not G.has_edge(*edge):
+                G.add_edge(*edge)
+                self.inferred.add(edge)
+                added.append(edge)
+        return added, removed
+
+    def set_hide_list(self, hide_list, state):
+        self.hide_list = list(hide_list)
+        self.hide = LabelFilter(self.hide_list)
+        self.labels.clear()
+        for key in state_keys:
+            for idx, data in state[key].items():
+                nodekey = key + "_" + str(idx)
+                if nodekey in self.G:
+                    self.G.nodes[nodekey]['label'] = self.node_label(nodekey, data)[1]
+        self.track_all()
+        self.update_inferred_edges(state)
+
+    def apply(self, state, delta):
+        """Apply a state delta (see delta.diff_states) and return what changed in the graph."""
+        G = self.G
+        changes = {
+            "nodes": {"added": [], "removed": [], "modified": []},
+            "edges": {"added": [], "removed": []},
+        }
+        # Labels of nodes that came, went or were renamed; inferred edges only need another look
+        # if one of them can take part in one
+        touched = []
+
+        def remove_node(nodekey):
+            label = TRAILING_NODE_ID.sub('', G.nodes[nodekey]['label'])
+            self.track_label(label, -1)
+            touched.append(label)
+            changes["edges"]["removed"].extend(list(G.in_edges(nodekey)) + list(G.out_edges(nodekey)))
+            G.remove_node(nodekey)
+            changes["nodes"]["removed"].append(nodekey)
+
+        def add_label(nodekey):
+            label = self.labels[nodekey][2]
+            self.track_label(label)
+            touched.append(label)
+
+        for key, idx in delta['nodes']['removed']:
+            nodekey = key + "_" + str(idx)
+            if nodekey in G:
+                remove_node(nodekey)
+            self.labels.pop(nodekey, None)
+
+        entered = []
+        for key, idx in delta['nodes']['added'] + delta['nodes']['modified']:
+            nodekey = key + "_" + str(idx)
+            attributes = self.node_attributes(nodekey, state[key][idx])
+            if attributes is None:
+                if nodekey in G:
+                    remove_node(nodekey)
+            elif nodekey in G:
+                if G.nodes[nodekey] != attributes:
+                    if G.nodes[nodekey]['label'] != attributes['label']:
+                        label = TRAILING_NODE_ID.sub('', G.nodes[nodekey]['label'])
+                        self.track_label(label, -1)
+                        touched.append(label)
+                        add_label(nodekey)
+                    G.nodes[nodekey].update(attributes)
+                    changes["nodes"]["modified"].append(nodekey)
+            else:
+                G.add_node(nodekey, **attributes)
+                add_label(nodekey)
+                changes["nodes"]["added"].append(nodekey)
+                entered.append(nodekey)
+
+        for edge in delta['edges']['removed']:
+            if G.has_edge(*edge) and edge not in self.inferred:
+                G.remove_edge(*edge)
+                changes["edges"]["removed"].append(edge)
+                # The connection may have stood in for a monitor or loopback edge, which now needs drawing
+                touched.extend(self.labels[node][2] for node in edge if node in self.labels)
+        edges = list(delta['edges']['added'])
+
+        # Nodes that were filtered out before (e.g. inactive with --active) bring back their
+        # existing connections, which are not part of the delta
+        added = {key + "_" + str(idx) for key, idx in delta['nodes']['added']}
+        returning = set(entered) - added
+        if returning:
+            for key, (from_key, to_key) in connection_keys.items():
+                for conn in state['connections'][key]:
+                    from_id = key + "_" + str(conn[from_key])
+                    to_id = to_key + "s_" + str(conn[to_key])
+                    if from_id in returning or to_id in returning:
+                        edges.append((from_id, to_id))
+
+        spurious = 0
+        for edge in edges:
+            if add_connection_edge(G, *edge, self.inferred):
+                if edge in self.inferred:
+                    self.inferred.discard(edge)
                 else:
-                    pass
-                    # if "sinks_139" in node and "sources_142" in target:
-                    #     print("No monitor connection: ", node, target)
-                    #     print(node_label, target_label)
- 
-                if re.match(r'^\s*L\d ', node_label): # and re.match(r'^L\d ', target_label):
-                    # print("                 ", node_label, target_label)
-                    #loopback = re.sub(r'^\s*(L\d) .*?$', r'\1', node_label)
-                    loopback = re.sub(r'^\s*', '', node_label)
-                    loopback = re.sub(r' .*$', '', loopback, flags=re.DOTALL)
-                    # print("LB=",loopback,"-")
-                    if loopback in checkloops:
-                        pass
-                    else:
-                        if target_label.startswith(loopback):
-                            print("Loop connection: ", node, target)
-                            print("                 ", node_label, target_label)
-                            from_id = node  # Assuming from_id is node
-                            to_id = target  # Assuming to_id is target
-                            edges_to_add.append((from_id, to_id))
-                            checkloops[loopback] = True
-
-    # Add edges after iteration
-    for from_id, to_id in edges_to_add:
-        G.add_edge(from_id, to_id)
-                                
-
-    # print(f"Nodes in graph: {G.nodes(data=True)}")
-    # print(f"Edges in graph: {G.edges(data=True)}")
-
-    return G
+                    changes["edges"]["added"].append(edge)
+            else:
+                spurious += 1
+
+        # Checked against the indexes as they are now, so a removed target whose monitor is
+        # still there counts, and so does a monitor that is gone
+        if any(self.takes_part(label) for label in touched):
+            added_edges, removed_edges = self.update_inferred_edges(state)
+            changes["edges"]["added"].extend(added_edges)
+            changes["edges"]["removed"].extend(removed_edges)
+
+        # No total edge count: networkx counts edges by walking every node
+        logger.info("Updated graph: %d nodes added, %d removed, %d modified; %d edges added, %d removed; "
+                    "%d spurious connections; %d nodes",
+                    len(changes["nodes"]["added"]), len(changes["nodes"]["removed"]), len(changes["nodes"]["modified"]),
+                    len(changes["edges"]["added"]), len(changes["edges"]["removed"]), spurious, len(G))
+        return changes
 
 # def add_dotted_edges(G):
 #     dotted_edges = []
@@ -144,71 +348,26 @@ def create_audio_routing_graph(state, text_wrap=30, hide_list=None, ignore_list=
 #     return dotted_edges
 
 
+column_labels = [
+    ("Playback\n(Sink Inputs)", 0),
+    ("Output Devices\n(Sinks)", 1),
+    ("Input Devices\n(Sources)", 2),
+    ("Recording\n(Source Outputs)", 3)
+]
+
+
 def update_graph(G, ax, fig, pos, last_update_time, only_active=False, spring_layout = True):
     labeloffset = 0.5
     ax.clear()
     node_labels = nx.get_node_attributes(G, 'label')
     wrapped_labels = wrap_labels(node_labels, 30)  # Adjust the width as needed
 
-    node_colors = [
-        'grey' if not G.nodes[node].get('active', False) else get_node_color(
-            G.nodes[node].get('type', 'unknown'))
-        for node in G.nodes
-    ]
-    node_sizes = [
-        500 if G.nodes[node].get('active', False) else 200
-        for node in G.nodes
-    ]
-
-    # Generate initial positions using spring layout
-    initial_pos = nx.spring_layout(G, seed=42)
-
-    pos = {}
-    x_offset = {'sink_input': 0, 'sink': 1,
-                'source': 2, 'source_output': 3, 'unknown': 4}
-
-    # Collect nodes by type and sort them alphabetically by label
-    nodes_by_type = {'sink_input': [], 'sink': [],
-                     'source': [], 'source_output': [], 'unknown': []}
-    for node, data in G.nodes(data=True):
-        node_type = data.get('type', 'unknown')
-        nodes_by_type[node_type].append((node, data))
-
-    for node_type in nodes_by_type:
-        nodes_by_type[node_type].sort(key=lambda x: x[1].get('label', ''))
-
-    y_positions = {node_type: 0 for node_type in nodes_by_type.keys()}
-    placed_positions = set()
-
-    def get_unique_position(x, y):
-        while (x, y) in placed_positions:
-            y -= 1
-        placed_positions.add((x, y))
-        return (x, y)
-
-    
-    for node_type, nodes in nodes_by_type.items():
-        for node, data in nodes:
-            if spring_layout and node in initial_pos:
-                x = x_offset[node_type]
-                # Scale the y-coordinate to avoid overlaps
-                y = initial_pos[node][1] * 10
-                pos[node] = get_unique_position(x, y)
-            else:
-                pos[node] = get_unique_position( x_offset[node_type], y_positions[node_type])
-                y_positions[node_type] -= 1
-
-    if spring_layout:
-        for node_type, nodes in nodes_by_type.items():
-            column_nodes = [node for node, _ in nodes]
-            if column_nodes:
-                min_y = min(pos[node][1] for node in column_nodes)
-                max_y = max(pos[node][1] for node in column_nodes)
-                step = (max_y - min_y) / (len(column_nodes) - 1) if len(column_nodes) > 1 else 0
-                for i, node in enumerate(sorted(column_nodes, key=lambda n: pos[n][1])):
-                    # print(x_offset[node_type], min_y + i * step)
-                    pos[node] = (x_offset[node_type], min_y + i * step)
-                
+    node_colors = [node_color(G.nodes[node]) for node in G.nodes]
+    node_sizes = [node_size(G.nodes[node]) for node in G.nodes]
+
+    # Keep previous positions where possible; pos=None recomputes the whole layout
+    pos = column_layout(G, pos, minimise_crossings=spring_layout)
+
     # nx.draw(G, pos, ax=ax, labels=wrapped_labels, node_color=node_colors,
     #         node_size=node_sizes, font_size=14, font_weight='bold', edge_color='gray', edgelist=[])
 
@@ -219,44 +378,15 @@ def update_graph(G, ax, fig, pos, last_update_time, only_active=False, spring_la
     nx.draw_networkx_labels( G, label_pos, labels=wrapped_labels, font_size=14, font_weight='bold')
 
     # Draw edges with specific styles
-    edge_colors = []
-    edges_to_reverse = []
-
-    for source, target in G.edges:
-        source_x, _ = pos[source]
-        target_x, _ = pos[target]
-        if (source_x == 3 and target_x == 2) or (source_x == 2 and target_x == 1) or (source_x == 0 and target_x == 3):
-            edges_to_reverse.append((source, target))
-
-    for source, target in edges_to_reverse:
-        G.remove_edge(source, target)
-        G.add_edge(target, source)
-
-    for source, target in G.edges:
-        source_x, _ = pos[source]
-        target_x, _ = pos[target]
-        if source_x == 0 and target_x == 1:
-            edge_colors.append('red')
-        elif source_x == 1 and target_x == 2:
-            edge_colors.append('green')
-        elif source_x == 2 and target_x == 3:
-            edge_colors.append('orange')
-        else:
-            edge_colors.append('lightgray')
+    edgelist = display_edges(G, pos)
+    edge_colors = [edge_color(pos, source, target) for source, target in edgelist]
 
     # print(G.nodes(data=True))
-    nx.draw_networkx_edges(G, pos, ax=ax, edge_color=edge_colors, width=2, connectionstyle='arc3, rad=0.2', arrows=True, arrowsize=30)
+    nx.draw_networkx_edges(G, pos, ax=ax, edgelist=edgelist, edge_color=edge_colors, width=2, connectionstyle='arc3, rad=0.2', arrows=True, arrowsize=30)
 
     update_text = f"Last update: {last_update_time.strftime('%Y-%m-%d %H:%M:%S')}"
     ax.text(0.95, 0.01, update_text, horizontalalignment='right', verticalalignment='bottom', transform=ax.transAxes, fontsize=10, color='gray')
 
-    column_labels = [
-        ("Playback\n(Sink Inputs)", 0),
-        ("Output Devices\n(Sinks)", 1),
-        ("Input Devices\n(Sources)", 2),
-        ("Recording\n(Source Outputs)", 3)
-    ]
-
     top_edge_y, top_edge_y = ax.get_ylim()
     for label, x in column_labels:
         ax.text(x, top_edge_y, label, horizontalalignment='center', verticalalignment='top', fontsize=12, color='black')
@@ -269,17 +399,60 @@ def update_graph(G, ax, fig, pos, last_update_time, only_active=False, spring_la
     return pos
 
 
+def node_color(data):
+    return 'grey' if not data.get('active', False) else get_node_color(data.get('type', 'unknown'))
+
+
+def node_size(data):
+    return 500 if data.get('active', False) else 200
+
+
+def edge_width(G, source, target):
+    # Bundled edges (see lod.py) get thicker with the number of edges they stand for
+    data = G.get_edge_data(source, target) or G.get_edge_data(target, source) or {}
+    return min(2 + 2 * math.log2(data.get('weight', 1)), 10)
+
+
+def edge_color(pos, source, target):
+    source_x, _ = pos[source]
+    target_x, _ = pos[target]
+    if source_x == 0 and target_x == 1:
+        return 'red'
+    elif source_x == 1 and target_x == 2:
+        return 'green'
+    elif source_x == 2 and target_x == 3:
+        return 'orange'
+    return 'lightgray'
+
+
+def display_edges(G, pos):
+    # Point edges left to right across the columns, without changing the graph itself
+    edges = []
+    reversed_edges = []
+    for source, target in G.edges:
+        source_x, _ = pos[source]
+        target_x, _ = pos[target]
+        if (source_x == 3 and target_x == 2) or (source_x == 2 and target_x == 1) or (source_x == 0 and target_x == 3):
+            reversed_edges.append((target, source))
+        else:
+            edges.append((source, target))
+    return list(dict.fromkeys(edges + reversed_edges))
+
+
 def wrap_text(text, width):
     return '\n'.join(text[i:i+width] for i in range(0, len(text), width))
 
 
 def remove_strings_from_labels(label, hide_list):
+    # A compiled LabelFilter removes all its terms in one pass
+    if isinstance(hide_list, LabelFilter):
+        return hide_list.remove(label)
     for hide_str in hide_list:
         label = label.replace(hide_str, '')
     return label
 
 def get_node_label(node, hide_list):
-    if isinstance(node, dict):
+    if isinstance(node, Mapping):
         label = node.get('label', 'Unknown')
     else:
         label = node.proplist.get('application.name', 'Unknown') if hasattr(
@@ -287,12 +460,11 @@ def get_node_label(node, hide_list):
     label = remove_strings_from_labels(label, hide_list)
     return label
 
+SHORT_NODE_ID = re.compile(r'(sources|sinks|sink_inputs|source_outputs)_(\d+)$')
+short_node_types = {'sources': 'sr', 'sinks': 'sn', 'sink_inputs': 'SI', 'source_outputs': 'SO'}
+
 def shortLabel(string):
-    string = re.sub(r'sources_(\d+)$', r'sr.\1', string)
-    string = re.sub(r'sinks_(\d+)$', r'sn.\1', string)
-    string = re.sub(r'sink_inputs_(\d+)$', r'SI.\1', string)
-    string = re.sub(r'source_outputs_(\d+)$', r'SO.\1', string)
-    return string
+    return SHORT_NODE_ID.sub(lambda match: short_node_types[match.group(1)] + '.' + match.group(2), string)
 
 def wrap_labels(labels, width):
     return {node: fill(shortLabel(label), width) for node, label in labels.items()}
@@ -333,9 +505,11 @@ def wrap_labels(labels, width):
 
 
 def save_graph_figure(G, pos, directory):
+    # pyplot is only needed for drawing, so headless exports never import it
+    import matplotlib.pyplot as plt
     if not os.path.exists(directory):
         os.makedirs(directory)
-    timestamp = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+    timestamp = datetime.now().strftime('%Y-%m-%d_%H-%M-%S_%f')
     plt.savefig(os.path.join(directory, f'graph_{timestamp}.png'))
 
 
@@ -353,17 +527,22 @@ def get_node_color(node_type):
 if __name__ == "__main__":
     import argparse
     import json
+    import sys
+    import matplotlib.pyplot as plt
+    from history import HistoryReader
 
     parser = argparse.ArgumentParser(
         description="Visualize PulseAudio routing.")
     parser.add_argument('--text_wrap', type=int, default=30,
                         help='Number of characters after which to wrap text labels.')
-    parser.add_argument('--hide', nargs='+', default=[],
+    parser.add_argument('--hide', nargs='+', default=[], type=filter_term,
                         help='List of strings to hide from graph labels.')
-    parser.add_argument('--ignore', nargs='+', default=[],
+    parser.add_argument('--ignore', nargs='+', default=[], type=filter_term,
                         help='List of strings to ignore from audio sources and sinks.')
     parser.add_argument('--active', action='store_true',
                         help='Only show active elements in the graph.')
+    parser.add_argument('--at',
+                        help='Show the recorded state at this time (YYYY-MM-DD HH:MM:SS) instead of the latest.')
     args = parser.parse_args()
 
     plt.ion()
@@ -371,10 +550,20 @@ if __name__ == "__main__":
     fig, ax = plt.subplots(figsize=(20, 10))
     pos = None
 
-    latest_json_file = sorted([f for f in os.listdir(
-        './graphs') if f.startswith('state_')], reverse=True)[0]
-    with open(os.path.join('./graphs', latest_json_file), 'r') as f:
-        state = json.load(f)
+    if os.path.exists(os.path.join('./graphs', 'history.idx')):
+        history = HistoryReader('./graphs')
+        if args.at:
+            state = history.state_at(datetime.strptime(args.at, '%Y-%m-%d %H:%M:%S').timestamp())
+        else:
+            state = history.latest()
+        if state is None:
+            sys.exit("No recorded state at that time.")
+    else:
+        # Older recordings: one state_<timestamp>.json file per change
+        latest_json_file = sorted([f for f in os.listdir(
+            './graphs') if f.startswith('state_')], reverse=True)[0]
+        with open(os.path.join('./graphs', latest_json_file), 'r') as f:
+            state = json.load(f)
 
     G = create_audio_routing_graph(state, text_wrap=args.text_wrap,
                                    hide_list=args.hide, ignore_list=args.ignore, only_active=args.active)
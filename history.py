@@ -0,0 +1,151 @@
+import bisect
+import json
+import os
+import struct
+import zlib
+from delta import NODE_KEYS, state_fingerprints
+from records import json_default
+
+# Record header: timestamp, payload length, flags
+HEADER = struct.Struct('>dIB')
+KEYFRAME = 1
+COMPRESSED = 2
+
+
+class StateHistory:
+    """Append-only log of audio states.
+
+    A full keyframe is written every `keyframe_interval` records (and first
+    thing in every session), with compact deltas against the previous record in
+    between. Records go to history.log; history.idx has one line per record
+    with its timestamp, byte offset and kind, so a state can be rebuilt from the
+    nearest keyframe without reading the whole log.
+    """
+
+    def __init__(self, directory, keyframe_interval=100, compress=False):
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self.data_path = os.path.join(directory, 'history.log')
+        self.index_path = os.path.join(directory, 'history.idx')
+        self.keyframe_interval = keyframe_interval
+        self.compress = compress
+        self.previous = None
+        self.since_keyframe = 0
+
+    def append(self, state, timestamp):
+        fingerprints = state.get("fingerprints") or state_fingerprints(state)
+        if self.previous is None or self.since_keyframe >= self.keyframe_interval:
+            flags = KEYFRAME
+            payload = {key: state[key] for key in NODE_KEYS + ("connections",)}
+            self.since_keyframe = 0
+        else:
+            flags = 0
+            payload = state_delta(self.previous[0], self.previous[1], state, fingerprints)
+            self.since_keyframe += 1
+        self.previous = (state, fingerprints)
+
+        data = json.dumps(payload, separators=(',', ':'), default=json_default).encode()
+        if self.compress:
+            data = zlib.compress(data)
+            flags |= COMPRESSED
+
+        with open(self.data_path, 'ab') as f:
+            offset = f.tell()
+            f.write(HEADER.pack(timestamp, len(data), flags) + data)
+        # The index only points at complete records, so a crash mid-write loses at most that record
+        with open(self.index_path, 'a') as f:
+            f.write(f"{timestamp:.6f} {offset} {'K' if flags & KEYFRAME else 'D'}\n")
+        return offset
+
+
+def state_delta(previous, previous_fingerprints, state, fingerprints):
+    # Only records whose fingerprint changed, plus the connections if they changed at all
+    delta = {"set": {}, "del": {}}
+    for key in NODE_KEYS:
+        fps, previous_fps = fingerprints[key], previous_fingerprints[key]
+        changed = {idx: state[key][idx] for idx, fp in fps.items() if previous_fps.get(idx) != fp}
+        removed = [idx for idx in previous_fps if idx not in fps]
+        if changed:
+            delta["set"][key] = changed
+        if removed:
+            delta["del"][key] = removed
+    if fingerprints["connections"] != previous_fingerprints["connections"]:
+        delta["connections"] = state["connections"]
+    return delta
+
+
+def apply_state_delta(state, delta):
+    # Record keys are strings once they've been through JSON, as in the state files,
+    # and integers in deltas passed between processes
+    for key, records in delta["set"].items():
+        state[key].update(records)
+    for key, removed in delta["del"].items():
+        for idx in removed:
+            state[key].pop(idx, None)
+            state[key].pop(str(idx), None)
+    if "connections" in delta:
+        state["connections"] = delta["connections"]
+    return state
+
+
+def merge_state_deltas(first, second):
+    # One delta with the effect of applying `first`, then `second`
+    merged = {"set": {key: dict(records) for key, records in first["set"].items()},
+              "del": {key: list(removed) for key, removed in first["del"].items()}}
+    for key, records in second["set"].items():
+        merged["set"].setdefault(key, {}).update(records)
+        if key in merged["del"]:
+            merged["del"][key] = [idx for idx in merged["del"][key] if idx not in records]
+    for key, removed in second["del"].items():
+        for idx in removed:
+            merged["set"].get(key, {}).pop(idx, None)
+        merged["del"].setdefault(key, []).extend(removed)
+    if "connections" in second or "connections" in first:
+        merged["connections"] = second.get("connections", first.get("connections"))
+    return merged
+
+
+class HistoryReader:
+    def __init__(self, directory):
+        self.data_path = os.path.join(directory, 'history.log')
+        self.timestamps = []
+        self.offsets = []
+        self.keyframes = []
+        with open(os.path.join(directory, 'history.idx')) as f:
+            for line in f:
+                timestamp, offset, kind = line.split()
+                if kind == 'K':
+                    self.keyframes.append(len(self.offsets))
+                self.timestamps.append(float(timestamp))
+                self.offsets.append(int(offset))
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def read(self, f, position):
+        f.seek(self.offsets[position])
+        timestamp, length, flags = HEADER.unpack(f.read(HEADER.size))
+        data = f.read(length)
+        if flags & COMPRESSED:
+            data = zlib.decompress(data)
+        return timestamp, flags, json.loads(data)
+
+    def position_at(self, timestamp):
+        # Last record written at or before the timestamp, or None if there is none
+        position = bisect.bisect_right(self.timestamps, timestamp) - 1
+        return position if position >= 0 else None
+
+    def state_at_position(self, position):
+        keyframe = self.keyframes[bisect.bisect_right(self.keyframes, position) - 1]
+        with open(self.data_path, 'rb') as f:
+            _, _, state = self.read(f, keyframe)
+            for i in range(keyframe + 1, position + 1):
+                apply_state_delta(state, self.read(f, i)[2])
+        return state
+
+    def state_at(self, timestamp):
+        position = self.position_at(timestamp)
+        return None if position is None else self.state_at_position(position)
+
+    def latest(self):
+        return self.state_at_position(len(self) - 1) if len(self) else None
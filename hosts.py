@@ -0,0 +1,128 @@
+import concurrent.futures
+import logging
+import os
+import re
+import time
+import pulsectl
+from routing import generate_audio_state_json
+from history import StateHistory
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def host_directory(output_dir, server):
+    # One directory per server, e.g. ./graphs/tcp_studio-3_4713
+    return os.path.join(output_dir, re.sub(r'[^\w.-]+', '_', server).strip('_'))
+
+
+class Host:
+    """One PulseAudio server: its connection, last state and history.
+
+    The connection is opened on first use and re-opened after it fails, with
+    the wait between attempts doubling up to `max_retry_interval` seconds.
+    """
+
+    def __init__(self, server, connect, history, retry_interval=1, max_retry_interval=60):
+        self.server = server
+        self.connect = connect
+        self.history = history
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+        self.backoff = retry_interval
+        self.retry_at = 0
+        self.pulse = None
+        self.previous = None
+
+    def connection(self):
+        if self.pulse is None:
+            if time.monotonic() < self.retry_at:
+                return None
+            try:
+                self.pulse = self.connect(self.server)
+            except pulsectl.PulseError as e:
+                self.disconnected(e)
+                return None
+            logger.info("Connected to %s", self.server)
+            self.backoff = self.retry_interval
+        return self.pulse
+
+    def disconnected(self, error):
+        logger.warning("No connection to %s (%s), retrying in %s s", self.server, error, self.backoff)
+        if self.pulse is not None:
+            try:
+                self.pulse.close()
+            except Exception:
+                pass
+        self.pulse = None
+        self.retry_at = time.monotonic() + self.backoff
+        self.backoff = min(self.backoff * 2, self.max_retry_interval)
+
+    def poll(self):
+        # Returns the new state, or None while the server can't be reached
+        pulse = self.connection()
+        if pulse is None:
+            return None
+        try:
+            with metrics.timer('host_poll'):
+                state = generate_audio_state_json(pulse, previous_state=self.previous)
+        except (pulsectl.PulseError, pulsectl.PulseDisconnected) as e:
+            self.disconnected(e)
+            return None
+        self.previous = state
+        return state
+
+    def close(self):
+        if self.pulse is not None:
+            self.pulse.close()
+            self.pulse = None
+
+
+class HostPool:
+    """Polls many PulseAudio servers at once, one worker thread per server.
+
+    A host still busy with its previous poll is left alone until it answers,
+    so one slow or unreachable server never holds up the others. Each host
+    has its own change detection and its own history in `output_dir`.
+    """
+
+    def __init__(self, servers, output_dir, connect=None, keyframe_interval=100, compress=False,
+                 client_name='pulseaudio-routing-visualizer'):
+        if connect is None:
+            connect = lambda server: pulsectl.Pulse(client_name, server=server)
+        self.hosts = [Host(server, connect, StateHistory(host_directory(output_dir, server),
+                                                         keyframe_interval=keyframe_interval, compress=compress))
+                      for server in servers]
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(self.hosts), thread_name_prefix='host-poll')
+        # Host -> poll in progress
+        self.pending = {}
+
+    def poll(self, timeout=1):
+        # Returns [(host, state)] for the hosts that answered within the timeout and changed
+        for host in self.hosts:
+            if host not in self.pending:
+                self.pending[host] = self.executor.submit(host.poll)
+        done, _ = concurrent.futures.wait(list(self.pending.values()), timeout)
+
+        changes = []
+        for host, future in list(self.pending.items()):
+            if future not in done:
+                continue
+            del self.pending[host]
+            try:
+                state = future.result()
+            except Exception as e:
+                logger.warning("Polling %s failed: %s", host.server, e)
+                continue
+            if state is not None and state["has_changed"]:
+                changes.append((host, state))
+
+        metrics.gauge('hosts_waiting', len(self.pending))
+        metrics.gauge('hosts_connected', sum(host.pulse is not None for host in self.hosts))
+        return changes
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        for host in self.hosts:
+            if host not in self.pending:
+                host.close()
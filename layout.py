@@ -0,0 +1,83 @@
+# Fixed column for each node type, left to right
+x_offset = {'sink_input': 0, 'sink': 1,
+            'source': 2, 'source_output': 3, 'unknown': 4}
+
+
+def column_layout(G, previous_pos=None, minimise_crossings=True, sweeps=4):
+    """Place the nodes of G in one column per node type.
+
+    With previous positions, nodes that are still there keep their positions and
+    only new nodes are placed: in the free row nearest the barycentre of their
+    already placed neighbours, which is a gap left by a removed node or the end of
+    the column. Without previous positions the whole layout is recomputed:
+    alphabetical, then improved by barycentric sweeps across the columns. Without
+    minimising crossings the columns are always in alphabetical order.
+    """
+    columns = {node_type: [] for node_type in x_offset}
+    for node, data in G.nodes(data=True):
+        columns[data.get('type', 'unknown')].append(node)
+
+    label = lambda node: G.nodes[node].get('label', '')
+
+    if not minimise_crossings:
+        orders = {node_type: sorted(nodes, key=label) for node_type, nodes in columns.items()}
+        return spaced_positions(orders, centre=False)
+
+    if previous_pos is None:
+        orders = {node_type: sorted(nodes, key=label) for node_type, nodes in columns.items()}
+        for _ in range(sweeps):
+            for node_type in list(x_offset) + list(reversed(x_offset)):
+                orders[node_type] = barycentric_order(G, orders[node_type], spaced_positions(orders))
+        return spaced_positions(orders)
+
+    # Incremental: nothing that was already placed moves, so the renderer only has to
+    # draw what's new. Columns are re-centred by a full recompute.
+    pos = {node: (x_offset[node_type], previous_pos[node][1])
+           for node_type, nodes in columns.items() for node in nodes if node in previous_pos}
+    for node_type, nodes in columns.items():
+        new_nodes = sorted((node for node in nodes if node not in previous_pos), key=label)
+        taken = {pos[node][1] for node in nodes if node in pos}
+        for node in new_nodes:
+            y = free_row(taken, barycentre(G, node, pos))
+            taken.add(y)
+            pos[node] = (x_offset[node_type], y)
+    return pos
+
+
+def free_row(taken, target=None):
+    # Free row of a column nearest `target`; unconnected nodes (no target) fill the lowest gap or go to the bottom
+    if not taken:
+        return 0 if target is None else round(target)
+    top, bottom = max(taken), min(taken)
+    gaps = [bottom + i for i in range(1, int(top - bottom)) if bottom + i not in taken]
+    if target is None:
+        return gaps[0] if gaps else bottom - 1
+    return min(gaps + [top + 1, bottom - 1], key=lambda y: abs(y - target))
+
+
+def spaced_positions(orders, centre=True):
+    # One unit between nodes, top to bottom; centred columns line up better across the graph
+    pos = {}
+    for node_type, order in orders.items():
+        top = (len(order) - 1) / 2 if centre else 0
+        for i, node in enumerate(order):
+            pos[node] = (x_offset[node_type], top - i)
+    return pos
+
+
+def barycentre(G, node, pos):
+    # Mean height of the node's neighbours in other columns
+    x = pos[node][0] if node in pos else None
+    ys = [pos[other][1] for other in list(G.pred[node]) + list(G.succ[node]) if other in pos and pos[other][0] != x]
+    if not ys:
+        return None
+    return sum(ys) / len(ys)
+
+
+def barycentric_order(G, order, pos):
+    # Nodes without neighbours in other columns keep their current height
+    keys = {}
+    for node in order:
+        y = barycentre(G, node, pos)
+        keys[node] = pos[node][1] if y is None else y
+    return sorted(order, key=lambda node: -keys[node])
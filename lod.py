@@ -0,0 +1,56 @@
+import networkx as nx
+
+# Level of detail for large graphs: streams of the same application (or process)
+# are drawn as one cluster node, and the edges between clusters and devices as one
+# weighted edge each. The routing graph itself is left as it is, so exports and
+# history still see every stream.
+
+CLUSTER_TYPES = ('sink_input', 'source_output')
+
+
+def cluster_id(node_type, key):
+    return f"cluster:{node_type}:{key}"
+
+
+def cluster_key(data, group_by):
+    # The application name or process id a stream is grouped under, if it has one
+    return data.get(group_by) if data.get('type') in CLUSTER_TYPES else None
+
+
+def cluster_graph(G, group_by='application', min_size=2, expanded=()):
+    """Graph to draw in place of G, with streams grouped by `group_by`.
+
+    Groups of at least `min_size` streams become one node labelled with the
+    group and its size; clusters in `expanded` are drawn as their members.
+    Edges get a 'weight': how many edges of G they stand for.
+    """
+    groups = {}
+    for node, data in G.nodes(data=True):
+        key = cluster_key(data, group_by)
+        if key is not None:
+            groups.setdefault(cluster_id(data['type'], key), []).append(node)
+
+    members = {}
+    C = nx.DiGraph()
+    for cluster, nodes in groups.items():
+        if len(nodes) >= min_size and cluster not in expanded:
+            first = G.nodes[nodes[0]]
+            C.add_node(cluster, label=f"{first[group_by]} ({len(nodes)})", type=first['type'],
+                       active=any(G.nodes[node].get('active', False) for node in nodes),
+                       cluster=True, members=len(nodes))
+            for node in nodes:
+                members[node] = cluster
+
+    for node, data in G.nodes(data=True):
+        if node not in members:
+            C.add_node(node, **data)
+
+    for source, target in G.edges:
+        source, target = members.get(source, source), members.get(target, target)
+        if source == target:
+            continue
+        if C.has_edge(source, target):
+            C.edges[source, target]['weight'] += 1
+        else:
+            C.add_edge(source, target, weight=1)
+    return C
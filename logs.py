@@ -0,0 +1,46 @@
+import logging
+
+# Logging setup for the visualiser. Per-edge and per-node messages are at DEBUG,
+# so with the default level they are skipped before any formatting happens; each
+# graph build or update logs one summary line at INFO instead.
+
+
+class RateLimitFilter(logging.Filter):
+    """Lets through at most `burst` records of each message every `interval` seconds.
+
+    Messages are told apart by logger and format string, so "edge from %s to
+    %s" is one kind however many edges there are. The first record after a
+    quiet spell says how many were dropped.
+    """
+
+    def __init__(self, burst=10, interval=10):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        # (logger name, format string) -> [window start, records let through, records dropped]
+        self.windows = {}
+
+    def filter(self, record):
+        key = (record.name, record.msg)
+        window = self.windows.get(key)
+        if window is None or record.created - window[0] >= self.interval:
+            dropped = window[2] if window else 0
+            self.windows[key] = [record.created, 1, 0]
+            if dropped:
+                record.msg = f"{record.getMessage()} ({dropped} similar messages suppressed)"
+                record.args = None
+            return True
+        if window[1] < self.burst:
+            window[1] += 1
+            return True
+        window[2] += 1
+        return False
+
+
+def setup_logging(level='INFO', burst=10, interval=10):
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s', '%H:%M:%S'))
+    handler.addFilter(RateLimitFilter(burst, interval))
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(level)
@@ -0,0 +1,165 @@
+import bisect
+import contextlib
+import threading
+import time
+
+# Per-stage timers, counters and gauges for the monitor loop. Instrumentation is
+# off until enable() is called; while it is off timer() hands out one shared
+# do-nothing context and count()/gauge() return straight away.
+
+# Upper bounds, in seconds, of the latency histogram buckets
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+NULL_TIMER = contextlib.nullcontext()
+
+
+class Histogram:
+    def __init__(self):
+        # One count per bucket plus the overflow (+Inf) bucket
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-th observation
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.max
+
+
+class Timer:
+    __slots__ = ('metrics', 'stage', 'start')
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.stage, time.perf_counter() - self.start)
+
+
+class Metrics:
+    """Latency histograms per stage, plus counters and gauges.
+
+    Exposed as Prometheus text with serve(), or printed as a stats line every
+    few seconds with report_every(). Stages may be timed from any thread.
+    """
+
+    def __init__(self, prefix='pulseaudio_visualiser'):
+        self.prefix = prefix
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        # Gauges read when reported, e.g. the depth of the write queue
+        self.callbacks = {}
+
+    def enable(self):
+        self.enabled = True
+
+    def timer(self, stage):
+        if not self.enabled:
+            return NULL_TIMER
+        return Timer(self, stage)
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram()
+            histogram.observe(seconds)
+
+    def count(self, name, n=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def gauge(self, name, value):
+        if self.enabled:
+            self.gauges[name] = value
+
+    def gauge_callback(self, name, callback):
+        self.callbacks[name] = callback
+
+    def current_gauges(self):
+        gauges = dict(self.gauges)
+        for name, callback in self.callbacks.items():
+            gauges[name] = callback()
+        return gauges
+
+    def prometheus(self):
+        lines = []
+        with self.lock:
+            for name, value in sorted(self.counters.items()):
+                lines += [f"# TYPE {self.prefix}_{name}_total counter", f"{self.prefix}_{name}_total {value}"]
+            for name, value in sorted(self.current_gauges().items()):
+                lines += [f"# TYPE {self.prefix}_{name} gauge", f"{self.prefix}_{name} {value}"]
+            name = f"{self.prefix}_stage_seconds"
+            lines.append(f"# TYPE {name} histogram")
+            for stage, histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ('+Inf',), histogram.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_sum{{stage="{stage}"}} {histogram.sum:.6f}')
+                lines.append(f'{name}_count{{stage="{stage}"}} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    def stats_line(self):
+        with self.lock:
+            parts = [f"{name}={value}" for name, value in sorted(self.counters.items())]
+            parts += [f"{name}={value}" for name, value in sorted(self.current_gauges().items())]
+            for stage, histogram in sorted(self.histograms.items()):
+                parts.append(f"{stage}={histogram.sum / histogram.count * 1000:.1f}ms"
+                             f"(p95<{histogram.quantile(0.95) * 1000:g}ms,n={histogram.count})")
+        return ' '.join(parts)
+
+    def serve(self, port, host='127.0.0.1'):
+        # Imported here so --help and runs without an endpoint don't load http.server
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.prometheus().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+        print(f"Serving metrics on http://{host}:{server.server_address[1]}/metrics")
+        return server
+
+    def report_every(self, interval):
+        def run():
+            while True:
+                time.sleep(interval)
+                print(f"Stats: {self.stats_line()}")
+        threading.Thread(target=run, name='metrics-report', daemon=True).start()
+
+
+# Shared by every module, so stages can be timed without passing it around
+metrics = Metrics()
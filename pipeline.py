@@ -0,0 +1,247 @@
+import functools
+import multiprocessing
+import queue
+import signal
+import time
+from datetime import datetime
+
+# The window mode split over three processes, so a slow frame never delays the
+# next poll and layout runs on another core:
+#
+#   collector -- state deltas --> graph worker -- laid out graphs --> renderer
+#
+# Each link is a one-slot mailbox. A stage that is still busy when new work
+# arrives gets the newest version instead of a backlog: superseded deltas are
+# merged into the pending one, superseded frames are replaced.
+
+# How long the other processes get to stop on their own when the window closes, enough
+# for the collector's writer to finish (SnapshotWriter.close waits up to 10 s)
+STOP_TIMEOUT = 15
+
+
+class Stopped(Exception):
+    """Raised from the collector's wait once the pipeline is stopping."""
+
+
+class Mailbox:
+    """One-slot queue between two processes where the newest message wins."""
+
+    def __init__(self, ctx):
+        self.queue = ctx.Queue(1)
+        self.superseded = ctx.Value('i', 0)
+
+    def send(self, message, merge=None):
+        # merge(pending, message) folds a message that was never picked up into the new one
+        while True:
+            try:
+                self.queue.put_nowait(message)
+                return
+            except queue.Full:
+                try:
+                    pending = self.queue.get_nowait()
+                except queue.Empty:
+                    continue
+                with self.superseded.get_lock():
+                    self.superseded.value += 1
+                if merge is not None:
+                    message = merge(pending, message)
+
+    def receive(self, timeout=None):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+def start_child(args):
+    # Ctrl-C is handled by the renderer, which stops the other processes
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Spawned processes start with logging unconfigured
+    from logs import setup_logging
+    setup_logging(args.log_level)
+
+
+def run_collector(args, deltas, stop):
+    start_child(args)
+    import pulsectl
+    from audio_routing_visualiser import watch
+    from delta import NODE_KEYS
+    from history import StateHistory, apply_state_delta, merge_state_deltas, state_delta
+    from replay import copy_state
+    from writer import SnapshotWriter, Snapshot
+
+    writer = SnapshotWriter(args.write_queue)
+    history = StateHistory(args.output_dir, keyframe_interval=args.keyframe_interval, compress=args.compress_history)
+    sent = {'state': None}
+
+    def merge(pending, message):
+        if message["keyframe"]:
+            return message
+        if pending["keyframe"]:
+            # The worker hasn't seen a full state yet, so it still gets one
+            return dict(message, keyframe=True, delta=apply_state_delta(copy_state(pending["delta"]), message["delta"]))
+        return dict(message, delta=merge_state_deltas(pending["delta"], message["delta"]))
+
+    def on_change(current_state):
+        # Only what changed since the last message goes to the graph worker
+        previous = sent['state']
+        if previous is None:
+            message = {"keyframe": True, "delta": {key: current_state[key] for key in NODE_KEYS + ("connections",)}}
+        else:
+            message = {"keyframe": False,
+                       "delta": state_delta(previous, previous["fingerprints"], current_state, current_state["fingerprints"])}
+        message["timestamp"] = time.time()
+        deltas.send(message, merge)
+        sent['state'] = current_state
+        snapshot = Snapshot(current_state)
+        writer.submit(lambda: snapshot.write(args.output_dir, history))
+
+    def wait(seconds):
+        if stop.wait(seconds):
+            raise Stopped()
+
+    with pulsectl.Pulse('pulseaudio-routing-visualizer') as pulse:
+        try:
+            watch(args, pulse, on_change, wait)
+        except Stopped:
+            pass
+        finally:
+            writer.close()
+            # Nobody reads the deltas any more, so don't wait for the last one to be picked up
+            deltas.queue.cancel_join_thread()
+
+
+def run_graph_worker(args, deltas, frames, commands, stop):
+    start_child(args)
+    from delta import diff_states, record_delta
+    from graph import AudioRoutingGraph
+    from history import apply_state_delta
+    from layout import column_layout
+    from lod import cluster_graph
+    from replay import copy_state
+
+    routing_graph = AudioRoutingGraph(hide_list=args.hide, ignore_list=args.ignore, only_active=args.active)
+    state = {'mirror': None, 'pos': None, 'expanded': set(), 'timestamp': None}
+
+    def publish(relayout=False):
+        G = routing_graph.G
+        if args.cluster:
+            G = cluster_graph(G, args.cluster, args.cluster_min, state['expanded'])
+        state['pos'] = column_layout(G, None if relayout else state['pos'], minimise_crossings=not(args.alpha))
+        frames.send({"nodes": dict(G.nodes(data=True)), "edges": list(G.edges(data=True)),
+                     "pos": state['pos'], "timestamp": state['timestamp']})
+
+    while not stop.is_set():
+        relayout = False
+        changed = False
+        while True:
+            try:
+                command, node = commands.get_nowait()
+            except queue.Empty:
+                break
+            if command == 'expand':
+                state['expanded'].add(node)
+            elif command == 'collapse':
+                state['expanded'].discard(node)
+            relayout = relayout or command == 'relayout'
+            changed = True
+
+        message = deltas.receive(timeout=0.1)
+        if message is not None:
+            previous = state['mirror']
+            if message["keyframe"]:
+                mirror = dict(message["delta"])
+            else:
+                # A copy, so the previous mirror stays intact for the diff
+                mirror = apply_state_delta(copy_state(previous), message["delta"])
+            record_delta(mirror, diff_states(mirror, previous))
+            if previous is None:
+                routing_graph.rebuild(mirror)
+            else:
+                routing_graph.apply(mirror, mirror["delta"])
+            state['mirror'] = mirror
+            state['timestamp'] = message["timestamp"]
+            changed = True
+
+        if changed and state['mirror'] is not None:
+            publish(relayout)
+    frames.queue.cancel_join_thread()
+
+
+def run_pipeline(args):
+    import matplotlib.pyplot as plt
+    import networkx as nx
+    from render import RetainedRenderer
+    from writer import SnapshotWriter, Snapshot
+    from lod import cluster_id, cluster_key
+
+    # Spawned rather than forked: the renderer's GUI and threads don't survive a fork
+    ctx = multiprocessing.get_context('spawn')
+    deltas, frames = Mailbox(ctx), Mailbox(ctx)
+    commands = ctx.Queue()
+    stop = ctx.Event()
+    processes = [
+        ctx.Process(target=run_collector, args=(args, deltas, stop), name='collector', daemon=True),
+        ctx.Process(target=run_graph_worker, args=(args, deltas, frames, commands, stop), name='graph-worker', daemon=True),
+    ]
+    for process in processes:
+        process.start()
+
+    plt.ion()
+    fig, ax = plt.subplots(figsize=(20, 10))
+    renderer = RetainedRenderer(fig, ax, text_wrap=args.text_wrap)
+    # PNGs are written here; the collector keeps the history
+    writer = SnapshotWriter(args.write_queue)
+    view = {'G': None}
+
+    def on_key(event):
+        if event.key == 'r':
+            commands.put(('relayout', None))
+    fig.canvas.mpl_connect('key_press_event', on_key)
+
+    def on_pick(event):
+        if event.artist is not renderer.nodes or view['G'] is None or not len(event.ind):
+            return
+        node = renderer.node_at(event.ind[0])
+        if node.startswith('cluster:'):
+            commands.put(('expand', node))
+        elif node in view['G']:
+            data = view['G'].nodes[node]
+            key = cluster_key(data, args.cluster)
+            if key is not None:
+                commands.put(('collapse', cluster_id(data['type'], key)))
+    if args.cluster:
+        fig.canvas.mpl_connect('pick_event', on_pick)
+
+    try:
+        # Frames arrive whenever the worker has one; the window stays responsive in between
+        while plt.fignum_exists(fig.number):
+            frame = frames.receive(timeout=0)
+            if frame is None:
+                if not all(process.is_alive() for process in processes):
+                    raise SystemExit("A pipeline process stopped, see above.")
+                fig.canvas.start_event_loop(0.05)
+                continue
+            G = nx.DiGraph()
+            G.add_nodes_from(frame["nodes"].items())
+            G.add_edges_from(frame["edges"])
+            view['G'] = G
+            timestamp = datetime.fromtimestamp(frame["timestamp"])
+            renderer.draw(G, frame["pos"], timestamp)
+            image = renderer.capture()
+            if image is None:
+                renderer.save_figure(args.output_dir)
+                continue
+            # Bound now: a lambda would see whichever snapshot the loop got to by the time it runs
+            writer.submit(functools.partial(Snapshot(None, image, timestamp).write, args.output_dir, None))
+    finally:
+        print(f"Pipeline: {deltas.superseded.value} state updates merged, {frames.superseded.value} frames dropped")
+        # Asked to stop rather than terminated, so the collector writes out what it still has queued
+        stop.set()
+        deadline = time.monotonic() + STOP_TIMEOUT
+        for process in processes:
+            process.join(max(0, deadline - time.monotonic()))
+            if process.is_alive():
+                print(f"Pipeline: {process.name} didn't stop in time, terminating it")
+                process.terminate()
+        writer.close()
@@ -0,0 +1,238 @@
+import argparse
+import json
+import time
+from collections import deque
+
+# Answers questions such as "which sink does this application play to?" against the
+# live state. Nodes are indexed by application, process id, device name and type,
+# and the indexes are updated from each state delta rather than rebuilt.
+#
+# Reachability follows the signal: a stream plays into its sink, a sink feeds its
+# monitor source, a source feeds the streams recording from it, and the recording
+# end of a loopback feeds its playback end. The routing graph's edges don't all
+# point that way (recording streams point at their source, monitors at their sink),
+# so they are turned round by the types at either end.
+
+FLOWS = {('sink_input', 'sink'), ('sink', 'source'), ('source', 'source_output'), ('source_output', 'sink_input')}
+
+INDEXES = ('application', 'process', 'device', 'type')
+
+
+class RoutingIndex:
+    """Indexed view of the routing, kept up to date with update(state).
+
+    find() looks nodes up by attribute. downstream() and upstream() give the
+    nodes a node feeds or is fed by, directly or through any number of
+    devices and loopbacks; results are cached until an edge on the way changes.
+    """
+
+    def __init__(self):
+        # Imported here so `query --help` doesn't load networkx
+        from graph import AudioRoutingGraph, LOOPBACK_LABEL
+        # Unfiltered, so queries see everything, whatever the window hides
+        self.routing_graph = AudioRoutingGraph()
+        self.loopback_label = LOOPBACK_LABEL
+        self.built = False
+        # index name -> value -> node ids
+        self.indexes = {name: {} for name in INDEXES}
+        self.loopbacks = set()
+        # node id -> its (index name, value) entries, to drop them when it changes
+        self.entries = {}
+        self.succ = {}
+        self.pred = {}
+        self.reach = {'down': {}, 'up': {}}
+
+    def update(self, state):
+        if not self.built:
+            G = self.routing_graph.rebuild(state)
+            self.built = True
+            for node in G:
+                self.index_node(node)
+            for edge in G.edges:
+                self.add_flow(*edge)
+            return
+        changes = self.routing_graph.apply(state, state["delta"])
+        for edge in changes["edges"]["removed"]:
+            self.remove_flow(*edge)
+        for node in changes["nodes"]["removed"]:
+            self.unindex_node(node)
+            self.succ.pop(node, None)
+            self.pred.pop(node, None)
+        for node in changes["nodes"]["added"] + changes["nodes"]["modified"]:
+            self.unindex_node(node)
+            self.index_node(node)
+        for edge in changes["edges"]["added"]:
+            self.add_flow(*edge)
+
+    def index_node(self, node):
+        data = self.routing_graph.G.nodes[node]
+        # The label as PulseAudio has it, without hidden strings or the node id
+        label = self.routing_graph.labels[node][0]
+        entries = [('type', data['type'])]
+        if data['type'] in ('sink', 'source'):
+            entries.append(('device', label))
+        for name in ('application', 'process'):
+            if name in data:
+                entries.append((name, data[name]))
+        for name, value in entries:
+            self.indexes[name].setdefault(value, set()).add(node)
+        self.entries[node] = entries
+        if data['type'] in ('sink_input', 'source_output') and self.loopback_label.match(label):
+            self.loopbacks.add(node)
+
+    def unindex_node(self, node):
+        for name, value in self.entries.pop(node, ()):
+            nodes = self.indexes[name][value]
+            nodes.discard(node)
+            if not nodes:
+                del self.indexes[name][value]
+        self.loopbacks.discard(node)
+
+    def flow(self, u, v):
+        # The edge in the direction the signal goes
+        G = self.routing_graph.G
+        types = (G.nodes[u].get('type'), G.nodes[v].get('type')) if u in G and v in G else None
+        if types is not None and types not in FLOWS and types[::-1] in FLOWS:
+            return v, u
+        return u, v
+
+    def add_flow(self, u, v):
+        u, v = self.flow(u, v)
+        self.succ.setdefault(u, set()).add(v)
+        self.pred.setdefault(v, set()).add(u)
+        self.invalidate(u, v)
+
+    def remove_flow(self, u, v):
+        # Removed nodes may already be gone from the graph, so look for either direction
+        for u, v in ((u, v), (v, u)):
+            if v in self.succ.get(u, ()):
+                self.succ[u].discard(v)
+                self.pred[v].discard(u)
+                self.invalidate(u, v)
+
+    def invalidate(self, u, v):
+        # A new or removed u -> v changes what u and everything upstream of it reaches,
+        # and what v and everything downstream of it is reached from
+        if self.reach['down']:
+            for node in self.walk([u], self.pred):
+                self.reach['down'].pop(node, None)
+        if self.reach['up']:
+            for node in self.walk([v], self.succ):
+                self.reach['up'].pop(node, None)
+
+    @staticmethod
+    def walk(nodes, neighbours):
+        seen = set(nodes)
+        queue = deque(nodes)
+        while queue:
+            for neighbour in neighbours.get(queue.popleft(), ()):
+                if neighbour not in seen:
+                    seen.add(neighbour)
+                    queue.append(neighbour)
+        return seen
+
+    def reachable(self, node, direction):
+        cache = self.reach[direction]
+        if node not in cache:
+            cache[node] = frozenset(self.walk([node], self.succ if direction == 'down' else self.pred) - {node})
+        return cache[node]
+
+    def find(self, application=None, process=None, device=None, type=None):
+        """Nodes matching all the given attributes; all nodes if none are given."""
+        wanted = {'application': application, 'process': process, 'device': device, 'type': type}
+        found = None
+        for name, value in wanted.items():
+            if value is not None:
+                nodes = self.indexes[name].get(value, set())
+                found = set(nodes) if found is None else found & nodes
+        return set(self.routing_graph.G) if found is None else found
+
+    def downstream(self, nodes, type=None, direct=False, loopbacks=False):
+        """Nodes that the given nodes feed, optionally only of one type or only loopback streams."""
+        return self.related(nodes, 'down', type, direct, loopbacks)
+
+    def upstream(self, nodes, type=None, direct=False, loopbacks=False):
+        """Nodes that feed the given nodes, optionally only of one type or only loopback streams."""
+        return self.related(nodes, 'up', type, direct, loopbacks)
+
+    def related(self, nodes, direction, type, direct, loopbacks):
+        found = set()
+        for node in nodes:
+            if direct:
+                found |= (self.succ if direction == 'down' else self.pred).get(node, set())
+            else:
+                found |= self.reachable(node, direction)
+        if type is not None:
+            found &= self.indexes['type'].get(type, set())
+        if loopbacks:
+            found &= self.loopbacks
+        return found
+
+    def describe(self, node):
+        data = self.routing_graph.G.nodes[node]
+        return {'id': node, 'type': data['type'], 'label': self.routing_graph.labels[node][0],
+                'application': data.get('application'), 'process': data.get('process')}
+
+
+def answer(index, args):
+    nodes = index.find(args.app, args.pid, args.device, args.type if not (args.downstream or args.upstream) else None)
+    if args.downstream:
+        nodes = index.downstream(nodes, args.type, args.direct, args.loopbacks)
+    elif args.upstream:
+        nodes = index.upstream(nodes, args.type, args.direct, args.loopbacks)
+    elif args.loopbacks:
+        nodes = nodes & index.loopbacks
+    return sorted(nodes)
+
+
+def show(index, nodes, as_json):
+    if as_json:
+        print(json.dumps([index.describe(node) for node in nodes]))
+        return
+    for node in nodes:
+        description = index.describe(node)
+        print(f"{node}\t{description['type']}\t{description['label']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='audio_routing_visualiser.py query', fromfile_prefix_chars='@',
+                                     description="Query the live PulseAudio routing.")
+    parser.add_argument('--app', help='Streams of this application (application.name).')
+    parser.add_argument('--pid', help='Streams of this process id.')
+    parser.add_argument('--device', help='The sink or source with this name, e.g. "Monitor of Speakers".')
+    parser.add_argument('--type', choices=['sink', 'source', 'sink_input', 'source_output'],
+                        help='Only nodes of this type; with --downstream or --upstream, of the nodes found there.')
+    direction = parser.add_mutually_exclusive_group()
+    direction.add_argument('--downstream', action='store_true',
+                           help='What the matching nodes play or record into, through devices and loopbacks.')
+    direction.add_argument('--upstream', action='store_true',
+                           help='What feeds the matching nodes, through devices and loopbacks.')
+    parser.add_argument('--direct', action='store_true',
+                        help='With --downstream or --upstream, only the nodes one step away.')
+    parser.add_argument('--loopbacks', action='store_true',
+                        help='Only loopback streams.')
+    parser.add_argument('--json', action='store_true',
+                        help='Print a JSON list instead of one node per line.')
+    parser.add_argument('--watch', action='store_true',
+                        help='Keep running and print the answer again whenever it changes.')
+    args = parser.parse_args(argv)
+
+    import pulsectl
+    from routing import generate_audio_state_json
+
+    index = RoutingIndex()
+    with pulsectl.Pulse('pulseaudio-routing-visualizer') as pulse:
+        state = generate_audio_state_json(pulse)
+        index.update(state)
+        nodes = answer(index, args)
+        show(index, nodes, args.json)
+        while args.watch:
+            time.sleep(1)
+            state = generate_audio_state_json(pulse, previous_state=state)
+            if not state["has_changed"]:
+                continue
+            index.update(state)
+            previous, nodes = nodes, answer(index, args)
+            if nodes != previous:
+                print()
+                show(index, nodes, args.json)
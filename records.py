@@ -0,0 +1,66 @@
+import sys
+from collections.abc import Mapping
+
+# Compact node records. A poll produces one record per sink, source and stream;
+# records and proplists that haven't changed since the previous poll are reused
+# as they are, and only the ones that did change are allocated again.
+
+FIELDS = ('active', 'type', 'label', 'state', 'additional_info')
+
+
+class NodeRecord(Mapping):
+    """Read-only node record that reads like the state dicts did.
+
+    record['label'], record.get('type') and dict(record) all work, so code
+    written against the JSON state files accepts both. Expanded to a plain
+    dict only when written out, see json_default().
+    """
+
+    __slots__ = FIELDS
+
+    def __init__(self, active, type, label, state, additional_info):
+        self.active = active
+        self.type = type
+        self.label = label
+        self.state = state
+        self.additional_info = additional_info
+
+    def __getitem__(self, key):
+        if key not in FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self):
+        return iter(FIELDS)
+
+    def __len__(self):
+        return len(FIELDS)
+
+    def __repr__(self):
+        return f"NodeRecord({self.to_dict()!r})"
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in FIELDS}
+
+    def relabel(self, label):
+        return NodeRecord(self.active, self.type, label, self.state, self.additional_info)
+
+
+def intern_proplist(proplist):
+    # Property names repeat across every node and most values across polls
+    return {sys.intern(key): sys.intern(value) if isinstance(value, str) else value
+            for key, value in proplist.items()}
+
+
+def relabel(record, label):
+    # Records are shared between states, so relabelling makes a new one; works for plain dicts too
+    if isinstance(record, NodeRecord):
+        return record.relabel(label)
+    return dict(record, label=label)
+
+
+def json_default(obj):
+    # json.dump(state, f, default=json_default) expands records on the way out
+    if isinstance(obj, NodeRecord):
+        return obj.to_dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
@@ -0,0 +1,297 @@
+import bisect
+import logging
+import math
+import time
+import numpy as np
+from matplotlib.patches import FancyArrowPatch
+from graph import column_labels, display_edges, edge_color, edge_width, node_color, node_size, save_graph_figure, wrap_labels
+
+
+# Arrows stop this many points short of the node centres, as networkx does for its
+# default node size, so toggling a node's size doesn't touch its edges
+arrow_shrink = 300 ** 0.5 / 2
+# The vertical view limits grow in steps of this many rows, so a column growing by one
+# node only needs a full redraw every few nodes
+limit_step = 5
+
+logger = logging.getLogger(__name__)
+
+
+class RetainedRenderer:
+    """Draws the routing graph with long-lived artists instead of clearing the axes.
+
+    Nodes are one scatter collection, labels and edges one artist each, kept
+    across frames and only updated where they changed. The cached background
+    holds everything but the node markers and the update time, so an
+    active/inactive toggle is a blit of one collection, and new edges or labels
+    are drawn on top of the background without a full redraw. Anything that
+    moves or disappears, or new view limits, still needs a full redraw.
+
+    Labels and edges outside the view are hidden, and labels are only shown
+    once zoomed in far enough for rows `min_label_spacing` pixels apart, so a
+    frame costs what is visible rather than the size of the graph. Labels
+    and edges are only looked at again when their nodes come, go or move.
+    """
+
+    def __init__(self, fig, ax, label_offset=0.5, text_wrap=30, min_label_spacing=18):
+        self.fig = fig
+        self.ax = ax
+        self.label_offset = label_offset
+        self.text_wrap = text_wrap
+        self.min_label_spacing = min_label_spacing
+        self.blit = fig.canvas.supports_blit
+        self.background = None
+        self.limits = None
+        self.last_frame_time = None
+
+        ax.clear()
+        ax.set_axis_off()
+        self.order = []
+        self.pos = {}
+        self.nodes = ax.scatter([], [], zorder=2, animated=self.blit, picker=True)
+        self.labels = {}
+        # node -> label it was drawn with; raw label -> wrapped text
+        self.label_text = {}
+        self.wrapped = {}
+        self.edges = {}
+        # node -> the drawn edges at it
+        self.node_edges = {}
+        # (y, x, node) of every placed node, sorted, to find the ones in view by rows
+        self.rows = []
+        # What the last cull worked out: the view, and the labels and edges shown in it
+        self.view = None
+        self.shown_labels = set()
+        self.shown_edges = set()
+        self.update_text = ax.text(0.95, 0.01, '', horizontalalignment='right', verticalalignment='bottom',
+                                   transform=ax.transAxes, fontsize=10, color='gray', animated=self.blit)
+
+        self.headers = [
+            ax.text(x, 0, label, horizontalalignment='center', verticalalignment='top', fontsize=12, color='black')
+            for label, x in column_labels
+        ]
+        for x in range(4):
+            ax.axvline(x=x, color='gray', linestyle='--', linewidth=0.5)
+
+        fig.canvas.mpl_connect('draw_event', self.on_draw)
+        # Zooming and panning change what is worth drawing
+        ax.callbacks.connect('xlim_changed', self.cull)
+        ax.callbacks.connect('ylim_changed', self.cull)
+
+    def animated_artists(self):
+        return [self.nodes, self.update_text]
+
+    def on_draw(self, event):
+        # A full draw (first frame, resize, new limits) refreshes the cached background
+        if self.blit:
+            self.background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+            for artist in self.animated_artists():
+                self.ax.draw_artist(artist)
+
+    def draw(self, G, pos, last_update_time):
+        start = time.perf_counter()
+        # Artists created this frame, which can be drawn over the background as they are
+        new_artists = []
+        full_redraw = False
+
+        self.order = list(G.nodes)
+        self.nodes.set_offsets(np.array([pos[node] for node in self.order], dtype=float).reshape(-1, 2))
+        self.nodes.set_facecolor([node_color(G.nodes[node]) for node in self.order])
+        self.nodes.set_sizes([node_size(G.nodes[node]) for node in self.order])
+
+        if self.view is None:
+            self.view = self.current_view()
+        # Nodes that are new or moved; only their labels and edges need looking at
+        moved = set()
+        for node in list(self.pos):
+            if node not in pos:
+                self.unplace(node)
+                full_redraw = True
+        for node, xy in pos.items():
+            if self.pos.get(node) != xy:
+                if node in self.pos:
+                    self.unplace(node)
+                    full_redraw = True
+                self.place(node, xy)
+                moved.add(node)
+
+        for node in list(self.labels):
+            if node not in G:
+                self.labels.pop(node).remove()
+                del self.label_text[node]
+                self.shown_labels.discard(node)
+        for node, label in G.nodes(data='label'):
+            if label is None:
+                continue
+            text = self.labels.get(node)
+            if text is None:
+                text = self.ax.text(*self.label_position(node), self.wrap(label), horizontalalignment='center',
+                                    verticalalignment='center', fontsize=14, fontweight='bold', clip_on=True)
+                self.labels[node] = text
+                new_artists.append(text)
+            elif node in moved or self.label_text[node] != label:
+                text.set_position(self.label_position(node))
+                text.set_text(self.wrap(label))
+                full_redraw = True
+            else:
+                continue
+            self.label_text[node] = label
+            self.show_label(node)
+
+        edgelist = display_edges(G, pos)
+        wanted = set(edgelist)
+        for edge in list(self.edges):
+            if edge not in wanted:
+                self.edges.pop(edge).remove()
+                for node in edge:
+                    self.node_edges[node].discard(edge)
+                    if not self.node_edges[node]:
+                        del self.node_edges[node]
+                self.shown_edges.discard(edge)
+                full_redraw = True
+        for source, target in edgelist:
+            width = edge_width(G, source, target)
+            arrow = self.edges.get((source, target))
+            if arrow is None:
+                arrow = FancyArrowPatch(pos[source], pos[target], arrowstyle='-|>', connectionstyle='arc3, rad=0.2',
+                                        mutation_scale=30, linewidth=width, color=edge_color(pos, source, target),
+                                        zorder=1, shrinkA=arrow_shrink, shrinkB=arrow_shrink)
+                # add_artist rather than add_patch: the view limits are set from the positions, and
+                # updating the data limits from an arrow path costs as much as drawing it
+                self.ax.add_artist(arrow)
+                self.edges[(source, target)] = arrow
+                for node in (source, target):
+                    self.node_edges.setdefault(node, set()).add((source, target))
+                new_artists.append(arrow)
+            elif source in moved or target in moved:
+                arrow.set_positions(pos[source], pos[target])
+                arrow.set_color(edge_color(pos, source, target))
+                arrow.set_linewidth(width)
+                full_redraw = True
+            else:
+                if arrow.get_linewidth() != width:
+                    arrow.set_linewidth(width)
+                    full_redraw = True
+                continue
+            self.show_edge((source, target))
+        # Only does anything if the view changed without the limits changing, e.g. on a resize
+        self.cull()
+
+        self.update_text.set_text(f"Last update: {last_update_time.strftime('%Y-%m-%d %H:%M:%S')}")
+
+        limits = self.view_limits(pos)
+        if self.background is None or not self.blit or limits != self.limits or full_redraw:
+            self.limits = limits
+            self.ax.set_xlim(*limits[0])
+            self.ax.set_ylim(*limits[1])
+            for header in self.headers:
+                header.set_y(limits[1][1])
+            # Full redraw; on_draw caches the new background
+            self.fig.canvas.draw()
+        else:
+            self.fig.canvas.restore_region(self.background)
+            if new_artists:
+                for artist in new_artists:
+                    self.ax.draw_artist(artist)
+                self.background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+            for artist in self.animated_artists():
+                self.ax.draw_artist(artist)
+            self.fig.canvas.blit(self.fig.bbox)
+        self.fig.canvas.flush_events()
+
+        self.last_frame_time = time.perf_counter() - start
+        logger.debug("Rendered %d nodes and %d edges in %.1f ms", len(self.order), len(self.edges), self.last_frame_time * 1000)
+        return pos
+
+    def wrap(self, label):
+        wrapped = self.wrapped.get(label)
+        if wrapped is None:
+            wrapped = self.wrapped[label] = wrap_labels({None: label}, self.text_wrap)[None]
+        return wrapped
+
+    def label_position(self, node):
+        x, y = self.pos[node]
+        return x, y + self.label_offset
+
+    def place(self, node, xy):
+        self.pos[node] = xy
+        bisect.insort(self.rows, (xy[1], xy[0], node))
+
+    def unplace(self, node):
+        x, y = self.pos.pop(node)
+        del self.rows[bisect.bisect_left(self.rows, (y, x, node))]
+
+    def current_view(self):
+        (x0, x1), (y0, y1) = sorted(self.ax.get_xlim()), sorted(self.ax.get_ylim())
+        rows = y1 - y0
+        show_labels = rows <= 0 or self.ax.bbox.height / rows >= self.min_label_spacing
+        return x0, x1, y0, y1, show_labels
+
+    def in_view(self, node):
+        x0, x1, y0, y1, _ = self.view
+        x, y = self.pos[node]
+        return x0 <= x <= x1 and y0 <= y <= y1
+
+    def show_label(self, node):
+        visible = self.view[4] and self.in_view(node)
+        self.labels[node].set_visible(visible)
+        (self.shown_labels.add if visible else self.shown_labels.discard)(node)
+
+    def show_edge(self, edge):
+        visible = self.in_view(edge[0]) or self.in_view(edge[1])
+        self.edges[edge].set_visible(visible)
+        (self.shown_edges.add if visible else self.shown_edges.discard)(edge)
+
+    def cull(self, ax=None):
+        # New view limits: the nodes now in view are found by their rows, and only labels
+        # and edges that appear or disappear are changed
+        view = self.current_view()
+        if view == self.view:
+            return
+        self.view = x0, x1, y0, y1, show_labels = view
+        in_view = [node for _, x, node in self.rows[bisect.bisect_left(self.rows, (y0,)):
+                                                   bisect.bisect_right(self.rows, (y1, math.inf))]
+                   if x0 <= x <= x1]
+        labels = {node for node in in_view if node in self.labels} if show_labels else set()
+        edges = set()
+        for node in in_view:
+            edges.update(self.node_edges.get(node, ()))
+        for node in self.shown_labels - labels:
+            self.labels[node].set_visible(False)
+        for node in labels - self.shown_labels:
+            self.labels[node].set_visible(True)
+        for edge in self.shown_edges - edges:
+            self.edges[edge].set_visible(False)
+        for edge in edges - self.shown_edges:
+            self.edges[edge].set_visible(True)
+        self.shown_labels, self.shown_edges = labels, edges
+
+    def node_at(self, index):
+        # Graph node of a point in the node collection, e.g. from a pick event
+        return self.order[index]
+
+    def capture(self):
+        # Copy of the rendered frame, for writing out on another thread; None if the
+        # backend has no pixel buffer
+        if not hasattr(self.fig.canvas, 'buffer_rgba'):
+            return None
+        return np.array(self.fig.canvas.buffer_rgba())
+
+    def save_figure(self, directory):
+        # Animated artists are left out of normal draws, so include them while saving
+        artists = self.animated_artists()
+        for artist in artists:
+            artist.set_animated(False)
+        try:
+            save_graph_figure(None, None, directory)
+        finally:
+            for artist in artists:
+                artist.set_animated(self.blit)
+            self.background = None
+
+    def view_limits(self, pos):
+        xs = [x for x, _ in pos.values()] or [0]
+        ys = [y for _, y in pos.values()] or [0]
+        # Room for the labels above the nodes and the column headers above those
+        return ((min(min(xs), 0) - 0.5, max(max(xs), 3) + 0.5),
+                (math.floor(min(ys) / limit_step) * limit_step - 1,
+                 math.ceil(max(ys) / limit_step) * limit_step + self.label_offset + 1.5))
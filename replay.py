@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+import argparse
+import sys
+import time
+from datetime import datetime
+from delta import NODE_KEYS, diff_states, record_delta
+from filters import filter_term
+from history import KEYFRAME, HistoryReader, apply_state_delta
+
+# Plays the recorded history back through the same graph and drawing code as the
+# live view. Seeking reads the nearest keyframe and the deltas after it; playing
+# reads one record per step from an open log.
+
+
+def copy_state(state):
+    # New per-key dicts sharing the records, so the previous state stays intact
+    copied = {key: dict(state[key]) for key in NODE_KEYS}
+    copied["connections"] = state["connections"]
+    return copied
+
+
+class HistoryPlayer:
+    """Steps through a recorded history, one record at a time."""
+
+    def __init__(self, reader):
+        self.reader = reader
+        self.file = open(reader.data_path, 'rb')
+        self.position = None
+        self.state = None
+
+    def seek(self, timestamp):
+        # The first record if the timestamp is before the recording started
+        position = self.reader.position_at(timestamp)
+        return self.seek_position(0 if position is None else position)
+
+    def seek_position(self, position):
+        position = max(0, min(position, len(self.reader) - 1))
+        self.state = self.reader.state_at_position(position)
+        self.position = position
+        return self.state
+
+    def timestamp(self, position=None):
+        return self.reader.timestamps[self.position if position is None else position]
+
+    def step(self):
+        # The next state, or None at the end of the recording
+        if self.position is None:
+            return self.seek_position(0)
+        if self.position + 1 >= len(self.reader):
+            return None
+        _, flags, payload = self.reader.read(self.file, self.position + 1)
+        self.state = payload if flags & KEYFRAME else apply_state_delta(copy_state(self.state), payload)
+        self.position += 1
+        return self.state
+
+    def close(self):
+        self.file.close()
+
+
+def parse_time(text):
+    return datetime.strptime(text, '%Y-%m-%d %H:%M:%S').timestamp()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded PulseAudio routing.", fromfile_prefix_chars='@')
+    parser.add_argument('--history_dir', default='./graphs',
+                        help='Directory with the recorded history.')
+    parser.add_argument('--start', help='Start playing at this time (YYYY-MM-DD HH:MM:SS).')
+    parser.add_argument('--end', help='Stop playing at this time (YYYY-MM-DD HH:MM:SS).')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='Playback speed, e.g. 60 plays a minute of history per second.')
+    parser.add_argument('--max_wait', type=float, default=2.0,
+                        help='Longest pause between two changes, in seconds of playback.')
+    parser.add_argument('--text_wrap', type=int, default=30,
+                        help='Number of characters after which to wrap text labels.')
+    parser.add_argument('--hide', nargs='+', default=[], type=filter_term,
+                        help='List of strings to hide from graph labels; re:PATTERN for a regular expression.')
+    parser.add_argument('--ignore', nargs='+', default=[], type=filter_term,
+                        help='List of strings to ignore from audio sources and sinks; re:PATTERN for a regular expression.')
+    parser.add_argument('--active', action='store_true',
+                        help='Only show active elements in the graph.')
+    parser.add_argument('--alpha', action='store_true',
+                        help='Sort nodes alphabetically, rather than with minimised edge crossings.')
+    args = parser.parse_args()
+
+    import matplotlib.pyplot as plt
+    from graph import AudioRoutingGraph, update_graph
+
+    reader = HistoryReader(args.history_dir)
+    if not len(reader):
+        sys.exit("No recorded history.")
+    player = HistoryPlayer(reader)
+    end = parse_time(args.end) if args.end else float('inf')
+
+    start = time.perf_counter()
+    state = player.seek(parse_time(args.start)) if args.start else player.step()
+    print(f"Seeked to record {player.position} of {len(reader)} in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    plt.ion()
+    fig, ax = plt.subplots(figsize=(20, 10))
+    routing_graph = AudioRoutingGraph(hide_list=args.hide, ignore_list=args.ignore, only_active=args.active)
+    view = {'pos': None, 'paused': False, 'seek': None}
+
+    # Space pauses, left and right jump a minute of recorded time
+    def on_key(event):
+        if event.key == ' ':
+            view['paused'] = not view['paused']
+        elif event.key in ('left', 'right'):
+            view['seek'] = player.timestamp() + (60 if event.key == 'right' else -60)
+    fig.canvas.mpl_connect('key_press_event', on_key)
+
+    def show(state, previous=None):
+        if previous is None:
+            routing_graph.rebuild(state)
+        else:
+            routing_graph.apply(state, record_delta(state, diff_states(state, previous))["delta"])
+        view['pos'] = update_graph(routing_graph.G, ax, fig, view['pos'], datetime.fromtimestamp(player.timestamp()),
+                                   only_active=args.active, spring_layout=not(args.alpha))
+
+    show(state)
+    while plt.fignum_exists(fig.number):
+        if view['seek'] is not None:
+            state = player.seek(view['seek'])
+            view['seek'] = None
+            show(state)
+            continue
+        if view['paused']:
+            fig.canvas.start_event_loop(0.1)
+            continue
+
+        previous, timestamp = state, player.timestamp()
+        state = player.step()
+        if state is None or player.timestamp() > end:
+            break
+        fig.canvas.start_event_loop(max(0.01, min((player.timestamp() - timestamp) / args.speed, args.max_wait)))
+        show(state, previous)
+
+    player.close()
+    plt.show()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,11 +3,17 @@ import json
 from datetime import datetime
 import os
 import re
+from delta import diff_states, record_delta
+from metrics import metrics
+from records import NodeRecord, intern_proplist, relabel
+
+# The "L1 " label_loopbacks puts in front of loopback stream labels
+LOOPBACK_TAG = re.compile(r"^L\d+ (?=Loopback)")
 
 def fetch_node_state(string):
     return str(string).split( '=')[-1].strip('>') 
 
-def get_node_data(node, node_type):
+def get_node_data(node, node_type, previous=None):
     # Extract properties from node
     active = node.state == pulsectl.PulseStateEnum.running if hasattr(node, 'state') else False
     
@@ -26,78 +32,77 @@ def get_node_data(node, node_type):
         state = "unknown"
         active = True
     
-    # Include more detailed information if available
-    additional_info = {}
-    if hasattr(node, 'proplist'):
-        for key, value in node.proplist.items():
-            additional_info[key] = value
+    # Include more detailed information if available, sharing the previous proplist if it's the same
+    proplist = node.proplist if hasattr(node, 'proplist') else {}
+    if previous is not None and previous['additional_info'] == proplist:
+        # A loopback's previous record has its "L1 " tag already; label_loopbacks checks the number
+        if ((previous['active'], previous['type'], previous['state']) == (active, node_type, state)
+                and (previous['label'] == label or LOOPBACK_TAG.sub('', previous['label'], count=1) == label)):
+            return previous
+        additional_info = previous['additional_info']
+    else:
+        additional_info = intern_proplist(proplist)
 
-    return {
-        "active": active,
-        "type": node_type,
-        "label": label,
-        "state": state,
-        "additional_info": additional_info  # Store additional info if available
-    }
+    return NodeRecord(active, node_type, label, state, additional_info)
 
 
 def get_audio_routing(pulse):
-    sinks = pulse.sink_list()
-    sources = pulse.source_list()
-    sink_inputs = pulse.sink_input_list()
-    source_outputs = pulse.source_output_list()
+    with metrics.timer('list_sinks'):
+        sinks = pulse.sink_list()
+    with metrics.timer('list_sources'):
+        sources = pulse.source_list()
+    with metrics.timer('list_sink_inputs'):
+        sink_inputs = pulse.sink_input_list()
+    with metrics.timer('list_source_outputs'):
+        source_outputs = pulse.source_output_list()
 
     return sinks, sources, sink_inputs, source_outputs
 
 
-def normalize_state(state):
-    normalized = {
-        "sinks": {idx: get_node_data(sink, "sink") for idx, sink in state["sinks"].items()},
-        "sources": {idx: get_node_data(source, "source") for idx, source in state["sources"].items()},
-        "sink_inputs": {idx: get_node_data(sink_input, "sink_input") for idx, sink_input in state["sink_inputs"].items()},
-        "source_outputs": {idx: get_node_data(source_output, "source_output") for idx, source_output in state["source_outputs"].items()},
-        "connections": {
-            "sink_inputs": [{"input": conn["input"], "sink": conn["sink"]} for conn in state["connections"]["sink_inputs"]],
-            "source_outputs": [{"output": conn["output"], "source": conn["source"]} for conn in state["connections"]["source_outputs"]]
-        }
-    }
-    return normalized
-
-
-def generate_audio_state_json(pulse, previous_state=None, directory="./graphs"):
-    sinks, sources, sink_inputs, source_outputs = get_audio_routing(pulse)
-
-    state = {
-        "sinks": {sink.index: get_node_data(sink, "sink") for sink in sinks},
-        "sources": {source.index: get_node_data(source, "source") for source in sources},
-        "sink_inputs": {sink_input.index: get_node_data(sink_input, "sink_input") for sink_input in sink_inputs},
-        "source_outputs": {source_output.index: get_node_data(source_output, "source_output") for source_output in source_outputs},
+def build_state(sinks, sources, sink_inputs, source_outputs, previous_state=None):
+    # Unchanged records are taken over from the previous state rather than rebuilt
+    previous = previous_state or {}
+    sinks_before, sources_before = previous.get("sinks", {}), previous.get("sources", {})
+    sink_inputs_before, source_outputs_before = previous.get("sink_inputs", {}), previous.get("source_outputs", {})
+    return {
+        "sinks": {sink.index: get_node_data(sink, "sink", sinks_before.get(sink.index)) for sink in sinks},
+        "sources": {source.index: get_node_data(source, "source", sources_before.get(source.index)) for source in sources},
+        "sink_inputs": {sink_input.index: get_node_data(sink_input, "sink_input", sink_inputs_before.get(sink_input.index)) for sink_input in sink_inputs},
+        "source_outputs": {source_output.index: get_node_data(source_output, "source_output", source_outputs_before.get(source_output.index)) for source_output in source_outputs},
         "connections": {
             "sink_inputs": [{"input": sink_input.index, "sink": sink_input.sink} for sink_input in sink_inputs],
             "source_outputs": [{"output": source_output.index, "source": source_output.source} for source_output in source_outputs]
         }
     }
 
-    normalized_state = normalize_state(state)
-    has_changed = previous_state is None or normalized_state != normalize_state(previous_state)
-
-    state["has_changed"] = has_changed
-    state["changed_items"] = {
-        "sinks": [idx for idx in state["sinks"] if previous_state is None or previous_state["sinks"].get(idx) != state["sinks"][idx]],
-        "sources": [idx for idx in state["sources"] if previous_state is None or previous_state["sources"].get(idx) != state["sources"][idx]],
-        "sink_inputs": [idx for idx in state["sink_inputs"] if previous_state is None or previous_state["sink_inputs"].get(idx) != state["sink_inputs"][idx]],
-        "source_outputs": [idx for idx in state["source_outputs"] if previous_state is None or previous_state["source_outputs"].get(idx) != state["source_outputs"][idx]]
-    }
-
 
+def label_loopbacks(state):
+    # Number loopback streams ("L1 Loopback ...") so both ends can be paired up in the graph.
+    # Records are replaced rather than edited, as callers may share them between states.
     loopbacks = ['sink_inputs', 'source_outputs']
     for key in loopbacks:
         i=0
-        for idx in state[key]:
-            if re.match("^Loopback", state[key][idx]['label']):
+        for idx, record in state[key].items():
+            # Records reused from the previous poll are tagged already, and keep their tag if it's still right
+            label = LOOPBACK_TAG.sub('', record['label'], count=1)
+            if re.match("^Loopback", label):
                 i += 1
                 #print(f"Loopback detected: {state[key][idx]['label']}")
-                state[key][idx]['label'] = "L" + str(i) + " " + state[key][idx]['label']
+                if record['label'] != "L" + str(i) + " " + label:
+                    state[key][idx] = relabel(record, "L" + str(i) + " " + label)
+    return state
+
+
+def generate_audio_state_json(pulse, previous_state=None, directory="./graphs", routing=None):
+    # routing: lists already fetched, e.g. by fetch.RoutingFetcher
+    if routing is None:
+        routing = get_audio_routing(pulse)
+    with metrics.timer('build_state'):
+        state = build_state(*routing, previous_state=previous_state)
+
+    with metrics.timer('diff'):
+        label_loopbacks(state)
+        record_delta(state, diff_states(state, previous_state))
 
     timestamp = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
     json_path = os.path.join(directory, f'state_{timestamp}.json')
@@ -0,0 +1,71 @@
+class RefreshScheduler:
+    """Decides when to poll PulseAudio and when to redraw.
+
+    Polls every `min_interval` seconds while things are changing and backs
+    off towards `max_interval` while they aren't. Changes are held back until
+    nothing new has arrived for `debounce` seconds, but never longer than
+    `max_delay`, so a burst of new streams becomes one redraw and one write.
+    """
+
+    def __init__(self, min_interval=0.25, max_interval=5, debounce=0.3, max_delay=2, backoff=1.5):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.backoff = backoff
+        self.interval = min_interval
+        # Changes seen since the last update, and when the first and last of them came
+        self.pending = 0
+        self.pending_since = None
+        self.last_change = None
+        self.started = None
+        self.polls = 0
+        self.changes = 0
+        self.updates = 0
+
+    def polled(self, changed, now):
+        if self.started is None:
+            self.started = now
+        self.polls += 1
+        if changed:
+            self.changes += 1
+            self.pending += 1
+            self.last_change = now
+            if self.pending_since is None:
+                self.pending_since = now
+            self.interval = self.min_interval
+        elif not self.pending:
+            self.interval = min(self.interval * self.backoff, self.max_interval)
+
+    def due(self, now):
+        # The first state is shown straight away
+        if not self.pending:
+            return False
+        return (self.updates == 0 or now - self.last_change >= self.debounce
+                or now - self.pending_since >= self.max_delay)
+
+    def updated(self):
+        self.updates += 1
+        self.pending = 0
+        self.pending_since = None
+
+    def next_wait(self, now):
+        if not self.pending:
+            return self.interval
+        until_due = min(self.last_change + self.debounce, self.pending_since + self.max_delay) - now
+        return max(0.01, min(self.interval, until_due))
+
+    def avoided_updates(self):
+        # Redraws and snapshot writes saved by folding changes together
+        return self.changes - self.pending - self.updates
+
+    def avoided_polls(self, now, interval=1):
+        # Compared with polling every `interval` seconds
+        if self.started is None:
+            return 0
+        return max(0, int((now - self.started) / interval) + 1 - self.polls)
+
+    def summary(self, now):
+        return (f"Refresh: {self.polls} polls, {self.changes} changes, {self.updates} updates; "
+                f"{self.avoided_updates()} redraws and writes avoided, "
+                f"{self.avoided_polls(now)} polls avoided compared with polling every second")
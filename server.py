@@ -0,0 +1,200 @@
+import collections
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Streams graph changes to any number of clients as server-sent events. Every
+# change is serialized once, when it's published; clients are handed the same
+# bytes, so adding clients doesn't add serialization work.
+
+PAGE = b"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>PulseAudio routing</title>
+<style>body{font-family:sans-serif;display:flex;gap:2em}ul{padding:0;list-style:none}
+li{margin:.3em 0;padding:.3em;border-radius:4px}.on{background:#cfc}.off{background:#eee}</style></head>
+<body><script>
+const columns = ['sink_input', 'sink', 'source', 'source_output'];
+const nodes = new Map(), edges = new Set();
+// Labels are set by PulseAudio clients, so they only ever go in as text
+function element(tag, text, className) {
+  const el = document.createElement(tag);
+  if (text !== undefined) el.textContent = text;
+  if (className) el.className = className;
+  return el;
+}
+function render() {
+  const links = [...edges].map(e => JSON.parse(e));
+  document.body.replaceChildren(...columns.map(type => {
+    const column = element('div'), list = element('ul');
+    column.append(element('h3', type), list);
+    [...nodes.values()].filter(n => n.type == type).sort((a, b) => a.label.localeCompare(b.label))
+      .forEach(n => {
+        const item = element('li', n.label, n.active ? 'on' : 'off');
+        item.append(element('br'), element('small', links.filter(e => e[0] == n.id || e[1] == n.id)
+          .map(e => e[0] == n.id ? '\u2192 ' + e[1] : '\u2190 ' + e[0]).join(', ')));
+        list.append(item);
+      });
+    return column;
+  }));
+}
+const source = new EventSource('events');
+source.addEventListener('snapshot', e => {
+  const data = JSON.parse(e.data);
+  nodes.clear(); edges.clear();
+  data.nodes.forEach(n => nodes.set(n.id, n));
+  data.edges.forEach(e => edges.add(JSON.stringify(e)));
+  render();
+});
+source.addEventListener('delta', e => {
+  const data = JSON.parse(e.data);
+  data.nodes.removed.forEach(id => nodes.delete(id));
+  data.nodes.added.concat(data.nodes.modified).forEach(n => nodes.set(n.id, n));
+  data.edges.removed.forEach(e => edges.delete(JSON.stringify(e)));
+  data.edges.added.forEach(e => edges.add(JSON.stringify(e)));
+  render();
+});
+</script></body></html>
+"""
+
+
+def sse_message(event, version, data):
+    return f"id: {version}\nevent: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n".encode()
+
+
+class GraphStream:
+    """Versioned stream of graph changes.
+
+    publish() takes the changes returned by AudioRoutingGraph.apply. The last
+    `backlog` messages are kept, so a client that reconnects with the last
+    version it saw only gets what it missed; older clients get a snapshot.
+    The stream keeps its own copy of the nodes and edges, so snapshots never
+    look at a graph that is being updated.
+    """
+
+    def __init__(self, backlog=256):
+        self.version = 0
+        self.messages = collections.deque(maxlen=backlog)
+        self.nodes = {}
+        self.edges = set()
+        self.snapshot_cache = None
+        self.condition = threading.Condition()
+
+    def publish(self, G, changes):
+        nodes = changes["nodes"]
+        message = {
+            "nodes": {
+                "added": [dict(G.nodes[node], id=node) for node in nodes["added"]],
+                "removed": list(nodes["removed"]),
+                "modified": [dict(G.nodes[node], id=node) for node in nodes["modified"]],
+            },
+            "edges": {
+                "added": [list(edge) for edge in changes["edges"]["added"]],
+                "removed": [list(edge) for edge in changes["edges"]["removed"]],
+            },
+        }
+        with self.condition:
+            for node in message["nodes"]["removed"]:
+                self.nodes.pop(node, None)
+            for node in message["nodes"]["added"] + message["nodes"]["modified"]:
+                self.nodes[node["id"]] = node
+            self.edges.difference_update(tuple(edge) for edge in message["edges"]["removed"])
+            self.edges.update(tuple(edge) for edge in message["edges"]["added"])
+
+            self.version += 1
+            message["version"] = self.version
+            self.messages.append((self.version, sse_message('delta', self.version, message)))
+            self.condition.notify_all()
+        return self.version
+
+    def publish_graph(self, G):
+        # Everything in G as one change, for the first state
+        removed_edges = [list(edge) for edge in self.edges]
+        return self.publish(G, {
+            "nodes": {"added": list(G.nodes), "removed": [node for node in self.nodes if node not in G], "modified": []},
+            "edges": {"added": list(G.edges), "removed": removed_edges},
+        })
+
+    def snapshot(self):
+        # Called with the condition held; built once per version however many clients ask
+        if self.snapshot_cache is None or self.snapshot_cache[0] != self.version:
+            data = {"version": self.version, "nodes": list(self.nodes.values()), "edges": [list(edge) for edge in self.edges]}
+            self.snapshot_cache = (self.version, data, sse_message('snapshot', self.version, data))
+        return self.snapshot_cache
+
+    def since(self, version):
+        # Messages after `version`, or None if some of them have already been dropped
+        if version == self.version:
+            return []
+        if not self.messages or version < self.messages[0][0] - 1 or version > self.version:
+            return None
+        return [message for message_version, message in self.messages if message_version > version]
+
+    def wait(self, version, timeout):
+        with self.condition:
+            self.condition.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+
+def serve(stream, port, host='127.0.0.1', keepalive=15):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def send_body(self, content_type, body):
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == '/':
+                self.send_body('text/html; charset=utf-8', PAGE)
+            elif url.path == '/snapshot':
+                with stream.condition:
+                    data = stream.snapshot()[1]
+                self.send_body('application/json', json.dumps(data).encode())
+            elif url.path == '/events':
+                since = parse_qs(url.query).get('since', [self.headers.get('Last-Event-ID')])[0]
+                # Anything that isn't a version we handed out gets a snapshot
+                try:
+                    version = int(since)
+                except (TypeError, ValueError):
+                    version = None
+                self.stream_events(version)
+            else:
+                self.send_error(404)
+
+        def stream_events(self, version):
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-cache')
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            self.close_connection = True
+            try:
+                while True:
+                    with stream.condition:
+                        messages = stream.since(version) if version is not None else None
+                        if messages is None:
+                            version, _, message = stream.snapshot()
+                            messages = [message]
+                        else:
+                            version = stream.version
+                    for message in messages:
+                        self.wfile.write(message)
+                    self.wfile.flush()
+                    if stream.wait(version, keepalive) == version:
+                        self.wfile.write(b": keepalive\n\n")
+                        self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='graph-server', daemon=True).start()
+    print(f"Serving graph changes on http://{host}:{server.server_address[1]}/")
+    return server
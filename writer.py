@@ -0,0 +1,102 @@
+import logging
+import os
+import queue
+import threading
+from datetime import datetime
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class SnapshotWriter:
+    """Writes snapshots to disk on a background thread.
+
+    Jobs wait in a bounded queue. When the disk can't keep up and the queue is
+    full, the oldest waiting snapshot is dropped in favour of the newest one;
+    those are counted as coalesced. Callers never block on disk I/O.
+    """
+
+    def __init__(self, maxsize=4):
+        self.queue = queue.Queue(maxsize)
+        self.lock = threading.Lock()
+        self.submitted = 0
+        self.written = 0
+        self.coalesced = 0
+        self.failed = 0
+        self.thread = threading.Thread(target=self.run, name='snapshot-writer', daemon=True)
+        self.thread.start()
+
+    def submit(self, job):
+        # job is a callable doing the actual writing; it must only use data it owns
+        with self.lock:
+            self.submitted += 1
+            while True:
+                try:
+                    self.queue.put_nowait(job)
+                    return
+                except queue.Full:
+                    try:
+                        self.queue.get_nowait()
+                        self.coalesced += 1
+                        metrics.count('snapshots_coalesced')
+                    except queue.Empty:
+                        pass
+
+    def run(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                break
+            try:
+                with metrics.timer('write'):
+                    job()
+                self.written += 1
+                metrics.count('snapshots_written')
+            except Exception as e:
+                self.failed += 1
+                metrics.count('snapshots_failed')
+                logger.error("Failed to write snapshot: %s", e)
+
+    def depth(self):
+        return self.queue.qsize()
+
+    def close(self, timeout=10):
+        # Let the queued snapshots finish, then stop the thread
+        self.queue.put(None)
+        self.thread.join(timeout)
+        print(f"Snapshots: {self.written} written, {self.coalesced} coalesced, {self.failed} failed")
+
+
+class Snapshot:
+    """State and rendered figure of one change, captured when it happened."""
+
+    def __init__(self, state, image=None, timestamp=None, exports=None):
+        # States are never modified once generated, so holding on to the dict is enough
+        self.state = state
+        self.image = image
+        # Export format -> already serialized graph text
+        self.exports = exports or {}
+        self.timestamp = timestamp or datetime.now()
+
+    def file_name(self, extension):
+        # Down to the microsecond: with debouncing, several changes can land in the same second
+        return f"graph_{self.timestamp.strftime('%Y-%m-%d_%H-%M-%S_%f')}.{extension}"
+
+    def write(self, directory, history):
+        # history is None where another process keeps the history, see pipeline.py
+        if history is not None:
+            history.append(self.state, self.timestamp.timestamp())
+            logger.debug("Saved state to %s", history.data_path)
+        if self.image is not None:
+            # Imported here so the writer itself doesn't pull in matplotlib
+            from matplotlib.image import imsave
+            image_path = os.path.join(directory, self.file_name('png'))
+            imsave(image_path, self.image)
+        self.write_exports(directory)
+
+    def write_exports(self, directory):
+        for export_format, text in self.exports.items():
+            export_path = os.path.join(directory, self.file_name(export_format))
+            with open(export_path, 'w') as f:
+                f.write(text)
+            logger.info("Exported graph to %s", export_path)